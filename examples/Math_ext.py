@@ -0,0 +1,27 @@
+# CESIL Plus - Example extension instruction plugin
+#
+# Copyright (C) 2020-2023, Ian Michael Dunmore
+#
+# License: https://github.com/idunmore/CESIL/blob/master/LICENSE
+#
+# Load with:  python3 src/CESIL.py -p --ext examples/Math_ext.py PROGRAM
+
+import math
+from CESIL import CESIL, CESILException, OpType
+
+
+@CESIL.instruction("ISQRT", OpType.NONE, True)
+def isqrt(cesil: CESIL):
+    '''Sets the ACCUMULATOR to its integer square root'''
+    if cesil.accumulator < 0:
+        raise CESILException(cesil.line_number,
+                             'Square root of a NEGATIVE value',
+                             cesil.accumulator)
+    cesil.accumulator = math.isqrt(cesil.accumulator)
+
+
+@CESIL.instruction("SUMSTK", OpType.NONE, True)
+def sum_stack(cesil: CESIL):
+    '''Pops every value off the STACK and puts their sum in the ACCUMULATOR'''
+    cesil.accumulator = sum(cesil.stack)
+    cesil.stack.clear()
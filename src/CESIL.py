@@ -6,18 +6,55 @@
 # License: https://github.com/idunmore/CESIL/blob/master/LICENSE
 
 import enum
+import hashlib
+import importlib
+import importlib.metadata
+import importlib.util
+import io
+import json
+import operator
+import os
 import re
+import sys
+import threading
+import time
 import click
-from typing import Self, Callable
-from random import randint
-from dataclasses import dataclass
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict, deque
+from functools import cached_property
+from itertools import chain, islice, zip_longest
+from types import MappingProxyType, MethodType, ModuleType
+from typing import (Self, Callable, Iterable, Iterator, Mapping, Sequence,
+                    TextIO)
+from random import Random
+from dataclasses import dataclass, field, asdict
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows; peak RSS is then not reported
+    resource = None
+try:
+    import fcntl
+except ImportError:
+    # Not available on Windows; coverage files are then not locked
+    fcntl = None
 
 # Constants
 
+# Interpreter version; cached run results are only reused by the same version
+VERSION = '0.9.3'
+
 # CESIL identifiers/labels consist of up to 6 uppercase alphanumeric
 # characters, starting with a letter (e.g. A12345)
 IDENTIFIER_PATTERN = re.compile('^[A-Z][A-Z0-9]{0,5}')
 
+# TEXT source lines are tokenized in a single pass; up to three whitespace
+# separated tokens (label, instruction, operand), with their positions kept so
+# PRINT strings can be taken from the raw line exactly as written.
+TEXT_LINE_PATTERN = re.compile(r'\s*(\S+)(?:\s+(\S+))?(?:\s+(\S+))?')
+
 # CESIL integers are signed 24-bit values from -8388608 to +8388607
 VALUE_MAX = 8388607
 VALUE_MIN = -8388608
@@ -41,12 +78,102 @@ STACK_EMPTY = 'Empty'
 ACC_FLAG_NONE = 'None'
 ACC_FLAG_NEG = 'Neg'
 ACC_FLAG_ZERO = 'Zero'
+DEBUG_DETAIL_HEADER = '\n\n\t[Stack:                 ] [Variable :    Value]'
+DEBUG_CHANGES_HEADER = '\n\n\t[Stack changes:         ] [Variable :    Value]'
+# Entered at a debug pause to show the full STACK and VARIABLES
+DEBUG_FULL_DUMP = 'd'
 
 # Coding Sheet/Card Column Positions
 LABEL_COL_START = 0
 INSTRUCTION_COL_START = 8
 OPERAND_COL_START = 16
 
+# Default maximum depths of the "Plus" STACK and SUBROUTINE call stack
+DEFAULT_MAX_STACK = 65536
+DEFAULT_MAX_CALLS = 65536
+
+# "Plus" indexed MEMORY; words by default.  A word is a C int (4 bytes on
+# all common platforms) if that holds any 24-bit CESIL value, else a long.
+DEFAULT_MEMORY_SIZE = 1024
+MEMORY_TYPE = 'i' if array('i').itemsize >= 3 else 'l'
+
+# Subroutine calls directly followed by RETURN are replaced by their
+# equivalent plain jump (tail-call elimination)
+TAIL_CALL_JUMPS = {'JUMPSR': 'JUMP', 'JSIZERO': 'JIZERO', 'JSINEG': 'JINEG'}
+
+# Instructions a memoizable ("pure") subroutine may use; their effect depends
+# only on the ACCUMULATOR, VARIABLES and (balanced) STACK use - no I/O
+PURE_INSTRUCTIONS = {
+    'LOAD', 'STORE', 'ADD', 'SUBTRACT', 'MULTIPLY', 'DIVIDE', 'MODULO',
+    'INC', 'DEC', 'PUSH', 'POP', 'JUMP', 'JIZERO', 'JINEG', 'JUMPSR',
+    'JSIZERO', 'JSINEG', 'RETURN'}
+SUBROUTINE_CALLS = {'JUMPSR', 'JSIZERO', 'JSINEG'}
+CONDITIONAL_JUMPS = {'JIZERO', 'JINEG', 'JSIZERO', 'JSINEG'}
+BRANCH_INSTRUCTIONS = {'JUMP', 'JIZERO', 'JINEG', 'JUMPSR', 'JSIZERO',
+                       'JSINEG'}
+INPUT_INSTRUCTIONS = {'IN', 'INPUTN'}
+
+# Execution hook callbacks that need the instrumented run loop; on_output
+# and on_halt hooks can be called from the uninstrumented loop.
+STEP_HOOKS = ('on_step', 'on_branch', 'on_call', 'on_return',
+              'on_variable_write', 'on_input')
+HOOKS = STEP_HOOKS + ('on_trace', 'on_output', 'on_halt')
+
+# Instructions a loop body may contain to be run as a compiled loop kernel,
+# and the Python statement (operating on accumulator "a") for each.
+KERNEL_STATEMENTS = {
+    'LOAD': 'a = {0}', 'STORE': '{0} = a', 'ADD': 'a += {0}',
+    'SUBTRACT': 'a -= {0}', 'MULTIPLY': 'a *= {0}', 'MODULO': 'a %= {0}',
+    'INC': 'a += 1', 'DEC': 'a -= 1'}
+KERNEL_CONDITIONS = {'JIZERO': 'a == 0', 'JINEG': 'a < 0'}
+
+# Output a compiled trace may also do (buffered until each iteration of the
+# loop completes), the jumps a trace may follow, and its longest path.
+TRACE_OUTPUT = {'OUT': 'str(a)', 'LINE': "'\\n'", 'PRINT': '{0!r}',
+                'OUTCHAR': 'chr(a)'}
+TRACE_JUMPS = {'JUMP', 'JIZERO', 'JINEG'}
+MAX_TRACE_LENGTH = 256
+
+# A loop is traced once its jump back has been taken TRACE_THRESHOLD times;
+# if it can't be, it is tried again after TRACE_RETRY more.
+TRACE_THRESHOLD = 16
+TRACE_RETRY = 1024
+
+# When detecting infinite loops, compiled traces stop this often so the
+# program state can be checked
+LOOP_CHECK_ITERATIONS = 4096
+
+# Run profiles are saved next to the source file, and loops whose jump back
+# was taken at least PROFILE_HOT_COUNT times are compiled as traces.
+PROFILE_SUFFIX = '.profile'
+PROFILE_HOT_COUNT = 64
+
+# Coverage files are locked, while coverage is merged into them, through a
+# file alongside each with this suffix.
+LOCK_SUFFIX = '.lock'
+
+# Cached run results are saved one per file; the least recently used are
+# removed beyond DEFAULT_CACHE_ENTRIES.
+CACHE_SUFFIX = '.json'
+DEFAULT_CACHE_ENTRIES = 4096
+
+# Entry point group under which installed packages offer extension
+# instruction plugins (see CESIL.load_extension())
+EXTENSION_GROUP = 'cesil.extensions'
+
+# Number of RANDOM values generated at a time
+RANDOM_BLOCK_SIZE = 256
+
+# Default maximum number of memoized subroutine results
+DEFAULT_MEMO_SIZE = 65536
+
+# Number of source lines sampled when auto-detecting TEXT/CARD format
+FORMAT_SAMPLE_LINES = 200
+
+# Forms of a program built when it is loaded, by (optimized, output
+# coalesced); output is not coalesced when there is an output quota.
+PROGRAM_VIEWS = ((False, False), (True, False), (True, True))
+
 # Classes
 
 class OpType(enum.Enum):
@@ -58,15 +185,27 @@ class OpType(enum.Enum):
     VAR = 4
 
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class CodeLine:
-    '''Represents the processable elements of line of CESIL code'''
+    '''Represents the processable elements of line of CESIL code; slotted,
+    as programs may have hundreds of thousands of lines, and immutable, as
+    they are shared by every CESIL instance running the program'''
     label: str
     instruction: str
     operand: str
     line_number: int = 0
 
 
+@dataclass(slots=True, frozen=True)
+class CoalescedLine(CodeLine):
+    '''A PRINT of the constant output of a run of lines (see
+    CESIL._coalesce_output()), with the lines it replaces, and the
+    instructions of those it runs in place of (all but the LOAD after it),
+    so runs count the steps and instructions of the program as written'''
+    folded: tuple[CodeLine, ...] = ()
+    counted: tuple[str, ...] = ()
+
+
 class CESILException(Exception):
     '''Base CESIL generic exception (syntax or runtime)'''
 
@@ -80,6 +219,280 @@ class CESILException(Exception):
               format(self.message, self.line_number, self.code))
 
 
+class CESILQuotaExceeded(CESILException):
+    '''Base for a program exceeding one of its memory quotas'''
+
+
+class StackQuotaExceeded(CESILQuotaExceeded):
+    '''Too many items PUSHed on the STACK'''
+
+    def __init__(self: Self, line_number: int, depth: int):
+        super().__init__(line_number,
+                         'Stack overflow; too many items on STACK', depth)
+
+
+class CallQuotaExceeded(CESILQuotaExceeded):
+    '''SUBROUTINE calls nested too deeply'''
+
+    def __init__(self: Self, line_number: int, depth: int):
+        super().__init__(line_number,
+                         'Call stack overflow; too many SUBROUTINE calls',
+                         depth)
+
+
+class VariableQuotaExceeded(CESILQuotaExceeded):
+    '''Too many distinct VARIABLES in the program'''
+
+    def __init__(self: Self, line_number: int, name: str):
+        super().__init__(line_number, 'Too many VARIABLES', name)
+
+
+class OutputQuotaExceeded(CESILQuotaExceeded):
+    '''Too many bytes output'''
+
+    def __init__(self: Self, line_number: int, output_bytes: int):
+        super().__init__(line_number, 'Output quota exceeded; too much output',
+                         output_bytes)
+
+
+class InfiniteLoopDetected(CESILException):
+    '''The program state repeated at a jump back to a loop, so the program
+    can never end'''
+
+    def __init__(self: Self, line_number: int, loop: str):
+        super().__init__(line_number, 'Infinite loop; program state repeats',
+                         loop)
+
+
+class HashedVariables(dict):
+    '''VARIABLES that keep a hash of their contents up to date as they are
+    written, so program states can be compared cheaply'''
+
+    def __init__(self: Self, variables: dict[str, int]):
+        super().__init__(variables)
+        self.state_hash = 0
+        for item in self.items(): self.state_hash ^= hash(item)
+
+    def __setitem__(self: Self, name: str, value: int):
+        if name in self: self.state_hash ^= hash((name, self[name]))
+        self.state_hash ^= hash((name, value))
+        super().__setitem__(name, value)
+
+
+class HashedMemory(array):
+    '''MEMORY that keeps a hash of its non-zero words up to date as they are
+    written, so program states can be compared cheaply'''
+
+    def __new__(cls: type, memory: array) -> 'HashedMemory':
+        return super().__new__(cls, memory.typecode, memory)
+
+    def __init__(self: Self, memory: array):
+        self.state_hash = 0
+        for item in enumerate(memory):
+            if item[1]: self.state_hash ^= hash(item)
+
+    def __setitem__(self: Self, address: int, value: int):
+        if self[address]: self.state_hash ^= hash((address, self[address]))
+        if value: self.state_hash ^= hash((address, value))
+        super().__setitem__(address, value)
+
+
+@dataclass(frozen=True, eq=False)
+class CESILProgram:
+    '''A loaded program: its instructions, LABELs, VARIABLES and DATA, as
+    parsed (see CESIL.program), and the forms of it each CESIL instance
+    runs, by their options (see PROGRAM_VIEWS): its lines and LABELs, as
+    optimized.  Immutable, as are the tables it holds, and hashable, so any
+    number of CESIL instances, each an execution context with its own run
+    state, can share one - across threads, async tasks or processes forked
+    after it loaded - without parsing, optimizing or copying it (see
+    context()).  The pure SUBROUTINEs of each form, which only memoization
+    needs, are found by the first context to memoize it, then shared.'''
+    is_plus: bool
+    lines: tuple[CodeLine, ...]
+    labels: Mapping[str, int]
+    variables: tuple[str, ...]
+    data_values: tuple[int, ...]
+    extensions: tuple[str, ...] = ()
+    views: Mapping[tuple[bool, bool], tuple] = field(
+        default_factory=dict, repr=False)
+    # Pure SUBROUTINEs, by form; each is only ever set to the same table
+    _pure_subroutines: dict = field(default_factory=dict, init=False,
+                                    repr=False)
+
+    def __post_init__(self: Self):
+        object.__setattr__(self, 'labels',
+                           MappingProxyType(dict(self.labels)))
+        # Views that are the same (nothing to optimize) stay shared
+        frozen = {}
+        for view in self.views.values():
+            if id(view) not in frozen:
+                lines, labels = view
+                frozen[id(view)] = (tuple(lines),
+                                    MappingProxyType(dict(labels)))
+        object.__setattr__(self, 'views', MappingProxyType(
+            {options: frozen[id(view)]
+             for options, view in self.views.items()}))
+
+    def __reduce__(self: Self) -> tuple:
+        views = {}
+        plain = {}
+        for options, view in self.views.items():
+            if id(view) not in plain:
+                lines, labels = view
+                plain[id(view)] = (lines, dict(labels))
+            views[options] = plain[id(view)]
+        return (CESILProgram, (
+            self.is_plus, self.lines, dict(self.labels), self.variables,
+            self.data_values, self.extensions, views))
+
+    @cached_property
+    def program_hash(self: Self) -> str:
+        '''Identifies the program's code and LABELs (see
+        CESILCoverage.hash_program())'''
+        return CESILCoverage.hash_program(self.lines, self.labels)
+
+    @cached_property
+    def _key(self: Self) -> tuple:
+        return (self.program_hash, self.is_plus, self.data_values,
+                self.extensions)
+
+    def __eq__(self: Self, other: object) -> bool:
+        return isinstance(other, CESILProgram) and self._key == other._key
+
+    def __hash__(self: Self) -> int:
+        return hash(self._key)
+
+    def context(self: Self, debug_level: int = 0, **options) -> 'CESIL':
+        '''A new CESIL instance, ready to run this program; "options" are
+        the CESIL() keyword arguments'''
+        cesil = CESIL(self.is_plus, debug_level, **options)
+        cesil.use_program(self)
+        return cesil
+
+
+@dataclass
+class CESILStats:
+    '''Performance statistics for loading and running a program; times
+    are in seconds'''
+    load_time: float = 0.0
+    parse_time: float = 0.0
+    data_time: float = 0.0
+    optimize_time: float = 0.0
+    execution_time: float = 0.0
+    instructions: int = 0
+    instructions_per_second: float = 0.0
+    mnemonic_counts: dict[str, int] = field(default_factory=dict)
+    peak_stack: int = 0
+    peak_call_depth: int = 0
+    output_bytes: int = 0
+    peak_rss: int | None = None
+    memo_hits: int = 0
+    memo_misses: int = 0
+
+    def to_json(self: Self) -> str:
+        '''Statistics as a JSON object'''
+        return json.dumps(asdict(self), indent=2)
+
+
+class CESILRandom():
+    '''Per-interpreter source of RANDOM values; reproducible for a given
+    seed, and generated in blocks to keep the per-instruction cost low'''
+
+    def __init__(self: Self, seed: int | None = None):
+        self._random = Random(seed)
+        self._block = []
+        self._position = 0
+
+    def next_value(self: Self, upper: int) -> int:
+        '''Returns a random integer from 0 to "upper", inclusive'''
+        if self._position == len(self._block):
+            random = self._random.random
+            self._block = [random() for _ in range(RANDOM_BLOCK_SIZE)]
+            self._position = 0
+        value = self._block[self._position]
+        self._position += 1
+        return int(value * (upper + 1))
+
+    def getstate(self: Self) -> tuple:
+        '''Returns the generator state (see CESIL.random_state)'''
+        return (self._random.getstate(), tuple(self._block), self._position)
+
+    def setstate(self: Self, state: tuple):
+        '''Restores a state returned by getstate()'''
+        random_state, block, self._position = state
+        self._random.setstate(random_state)
+        self._block = list(block)
+
+
+class CESILHooks():
+    '''Execution hooks, for tools that observe a running CESIL program.
+
+    Subclass and override only the callbacks needed; callbacks that are not
+    overridden are never called.  Registering hooks other than on_trace,
+    on_output and on_halt switches run() to its instrumented loop, which
+    does not use memoization, nor the loop kernels unless every such hooks
+    object also overrides on_trace; with no hooks registered there is no
+    per-instruction cost at all.  Hooks see the program as loaded, so pass
+    optimize=False to observe tail calls as written.'''
+
+    def on_step(self: Self, cesil: 'CESIL', index: int, line: CodeLine):
+        '''Called before the instruction at "index" executes'''
+
+    def on_branch(self: Self, cesil: 'CESIL', index: int, line: CodeLine,
+                  taken: bool):
+        '''Called after any jump, or subroutine call, instruction'''
+
+    def on_call(self: Self, cesil: 'CESIL', index: int, target: int):
+        '''Called after a SUBROUTINE call, from "index" to "target"'''
+
+    def on_return(self: Self, cesil: 'CESIL', index: int, return_index: int):
+        '''Called after RETURN; execution continues after "return_index"'''
+
+    def on_variable_write(self: Self, cesil: 'CESIL', name: str, value: int):
+        '''Called after a VARIABLE is written'''
+
+    def on_input(self: Self, cesil: 'CESIL', value: int):
+        '''Called after IN or INPUTN puts "value" in the ACCUMULATOR'''
+
+    def on_trace(self: Self, cesil: 'CESIL', trace: list[tuple[int, bool]],
+                 iterations: int, ended: bool):
+        '''Called after a compiled loop kernel runs "iterations" times round
+        "trace", instead of reporting each instruction.  "trace" lists the
+        instructions, by index, from the loop's LABEL to the jump back to
+        it, and whether each jump is taken; if "ended", the last iteration's
+        jump back fell through instead.'''
+
+    def on_output(self: Self, cesil: 'CESIL', text: str):
+        '''Called with the text each output instruction writes'''
+
+    def on_halt(self: Self, cesil: 'CESIL'):
+        '''Called when the program ends (HALT, or after the last line)'''
+
+
+class CESILDebugger(CESILHooks):
+    '''Debugger; shows execution state before each instruction executes.
+    Verbose output shows all VARIABLES and the STACK before the first
+    instruction, then only what each instruction changed.'''
+
+    def __init__(self: Self, level: int):
+        self._level = level
+        # VARIABLES written, and the STACK depth, since the last step
+        self._changed_variables = {}
+        self._stack_depth = None
+
+    def on_step(self: Self, cesil: 'CESIL', index: int, line: CodeLine):
+        changes = None
+        if self._stack_depth is not None:
+            changes = (self._changed_variables, self._stack_depth)
+        cesil._debug_out(self._level, changes)
+        self._changed_variables = {}
+        self._stack_depth = len(cesil.stack)
+
+    def on_variable_write(self: Self, cesil: 'CESIL', name: str, value: int):
+        self._changed_variables[name] = value
+
+
 class CESIL():
     '''CESIL Interpreter, Debugger & CESIL Program Instance'''
 
@@ -94,81 +507,674 @@ class CESIL():
             return func
         return _decorator
 
-    def __init__(self: Self, is_plus: bool, debug_level: int):
-        '''Initialize new CESIL instance.'''
+    # Names of the methods decorated as instructions; found on first use
+    _instruction_methods = None
+
+    def __init__(self: Self, is_plus: bool, debug_level: int,
+                 max_stack: int = DEFAULT_MAX_STACK,
+                 max_calls: int = DEFAULT_MAX_CALLS, memoize: bool = False,
+                 optimize: bool = True, seed: int | None = None,
+                 max_variables: int | None = None,
+                 max_output: int | None = None, detect_loops: bool = False,
+                 memory_size: int = DEFAULT_MEMORY_SIZE):
+        '''Initialize new CESIL instance.  The STACK, SUBROUTINE call depth,
+        distinct VARIABLES and bytes output are limited by the "max_"
+        quotas (None for no limit).  "detect_loops" stops a program, with
+        InfiniteLoopDetected, if its state repeats.  "Plus" MEMORY has
+        "memory_size" words.'''
         # CESIL Instructions
         self._instructions = {}
 
-        # CESIL Program Elements
+        # CESIL Program Elements; parsed into, then shared via, a CESILProgram
+        self._program = None
         self._program_lines = []
         self._data_values = []
         self._labels = {}
         self._variables = {}
+        # Integer LITERAL operands, so lines with equal values share one
+        self._literals = {}
 
         # Pure CESIL Execution State
         self._accumulator = 0
         self._instruction_ptr = 0
         self._data_ptr = 0
         self._current_line = None
+        self._steps = 0
+        self._step_limit = sys.maxsize
+        # Load and run statistics, if collected
+        self._stats = None
+        # Infinite loop detection (Brent's algorithm): the state saved, the
+        # back-edges until it is next saved and since, and the instructions
+        # between the loop LABELs and jumps seen since.
+        self._detect_loops = detect_loops
+        self._loop_state = None
+        self._loop_power = 1
+        self._loop_length = 0
+        self._loop_span = (0, 0)
         # "Plus" Execution State
         self._stack = []
         self._call_stack = []
+        self._memory = array(MEMORY_TYPE, [0]) * memory_size
+        self._max_stack = max_stack
+        self._max_calls = max_calls
+        self._max_variables = max_variables
+        self._variable_names = set()
+        self._max_output = max_output
+        self._seed = seed
+        self._rng = CESILRandom(seed)
+
+        # Optimizations (never applied when debugging); loop kernels (and
+        # traces) are keyed by the index of the jump that closes the loop.
+        self._optimize = optimize and debug_level == 0
+        self._loop_kernels = {}
+        # Times each loop's jump back has been taken, until it is traced
+        self._trace_counts = {} if self._optimize else None
+        # An output quota error must be reported at the line that output,
+        # so traces don't output if there is one.
+        self._trace_output = TRACE_OUTPUT if max_output is None else {}
+
+        # Memoization of "pure" subroutines: entry index -> VARIABLES in the
+        # cache key and VARIABLES restored on a cache hit.
+        self._memoize = memoize
+        self._pure_subroutines = {}
+        self._memo_cache = OrderedDict()
+        self._memo_size = DEFAULT_MEMO_SIZE
+        self._memo_pending = {}
+        self._memo_low_water = 0
+        self.memo_hits = 0
+        self.memo_misses = 0
 
         # File/program status and flags/values
         self._debug_level = debug_level
         self._is_text = True
         self._is_plus = is_plus
+        self._extensions = []
+        self._extension_mnemonics = set()
         self._branch = False
         self._halt_execution = False
 
+        # INPUTN values (from the console by default), optionally recorded
+        self._input_values = self._console_values()
+        self._input_record = None
+
+        # Output and execution hooks
+        self._output = None
+        self._write = None
+        self._hooks = []
+        self._trace_hooks = []
+        if debug_level > 0: self.add_hooks(CESILDebugger(debug_level))
+
         self._register_instructions()
 
+    @property
+    def accumulator(self: Self) -> int:
+        '''Current ACCUMULATOR value; instructions (such as extension
+        plugins) may set it, and it is range checked after each one'''
+        return self._accumulator
+
+    @accumulator.setter
+    def accumulator(self: Self, value: int):
+        self._accumulator = value
+
+    @property
+    def random_state(self: Self) -> tuple:
+        '''State of the RANDOM generator, to save with the rest of the
+        execution state (ACCUMULATOR, VARIABLES, STACK, MEMORY); setting
+        it to a saved state repeats the RANDOM values that followed'''
+        return self._rng.getstate()
+
+    @random_state.setter
+    def random_state(self: Self, state: tuple):
+        self._rng.setstate(state)
+
+    @property
+    def line_number(self: Self) -> int:
+        '''Source line number of the executing (or last executed)
+        instruction, for errors it raises; 0 if there is none'''
+        line = self._current_line
+        return 0 if line is None else line.line_number
+
+    @property
+    def variables(self: Self) -> dict[str, int]:
+        '''VARIABLES and their current values'''
+        return self._variables
+
+    @property
+    def stack(self: Self) -> list[int]:
+        '''The "Plus" STACK; the last item is the top'''
+        return self._stack
+
+    @property
+    def memory(self: Self) -> array:
+        '''The "Plus" indexed MEMORY words'''
+        return self._memory
+
+    @property
+    def call_stack(self: Self) -> list[int]:
+        '''Instruction indexes of active SUBROUTINE calls'''
+        return self._call_stack
+
+    @property
+    def program_lines(self: Self) -> Sequence[CodeLine]:
+        '''The loaded program; one CodeLine per instruction'''
+        return self._program_lines
+
+    @property
+    def labels(self: Self) -> Mapping[str, int]:
+        '''The loaded program's LABELs, and the instruction index of each'''
+        return self._labels
+
+    @property
+    def program(self: Self) -> CESILProgram | None:
+        '''The loaded program, to share with other CESIL instances'''
+        return self._program
+
+    def add_hooks(self: Self, hooks: CESILHooks):
+        '''Registers execution hooks, called in order of registration'''
+        self._hooks.append(hooks)
+
+    def remove_hooks(self: Self, hooks: CESILHooks):
+        '''Unregisters previously added execution hooks'''
+        self._hooks.remove(hooks)
+
+    def set_output(self: Self, output: TextIO | None):
+        '''Sets where program output is written (None for stdout)'''
+        self._output = output
+
+    def set_input(self: Self, source: TextIO | Iterable | None):
+        '''Sets where INPUTN values come from: None for the console, a text
+        stream (read in one go, values separated by whitespace) or any
+        iterable of values'''
+        if source is None:
+            self._input_values = self._console_values()
+        elif hasattr(source, 'read'):
+            self._input_values = iter(source.read().split())
+        else:
+            self._input_values = iter(source)
+
+    def record_input(self: Self, record: TextIO | None):
+        '''Writes each INPUTN value, one per line, to "record"; the record
+        can be replayed later with set_input()'''
+        self._input_record = record
+
+    @staticmethod
+    def _console_values() -> Iterator[str]:
+        '''INPUTN values typed at the console, until end of input'''
+        try:
+            while True: yield input()
+        except EOFError:
+            return
+
     def load(self: Self, filename: str, source_format: str):
-        '''Loads program file, observing TEXT/CARD formatting'''
+        '''Loads program file, observing TEXT/CARD/AUTO formatting'''
+        with open(filename, 'r') as reader:
+            self.load_lines(reader, source_format)
+
+    def load_lines(self: Self, lines: Iterable[str], source_format: str):
+        '''Loads program source lines, observing TEXT/CARD/AUTO formatting'''
         is_code_section = True
         line_number = 0
-        instruction_index = 0
+        start = data_start = time.perf_counter()
+        self._program_lines = []
+        self._labels = {}
+        self._variables = {}
+        self._data_values = []
 
         # Determine if we're parsing text file format or card
-        self._is_text = True if source_format[0].casefold() == 't' else False
+        lines = self._set_source_format(lines, source_format)
+
+        for line in lines:
+            line_number += 1
+            # Skip blank lines and comments.
+            if self._is_blank(line) or self._is_comment(line): continue
+
+            if is_code_section == True:
+                # Transition from Code to Data?
+                if self._is_data_start(line):
+                    is_code_section = False
+                    data_start = time.perf_counter()
+                else:
+                    # Process Code Line; label-only lines add no instruction
+                    self._process_code_line(line, len(self._program_lines),
+                                            line_number)
+            else:
+                # We're in the Data Section so process line as data values
+                self._process_data_line(line)
+
+        optimize_start = time.perf_counter()
+        if is_code_section: data_start = optimize_start
+
+        lines, labels = tuple(self._program_lines), self._labels
+        self._set_program(CESILProgram(
+            self._is_plus, lines, labels, tuple(self._variables),
+            tuple(self._data_values), tuple(self._extensions),
+            self._build_views(lines, labels)))
+        if self._stats is not None:
+            stats = self._stats
+            stats.parse_time = data_start - start
+            stats.data_time = optimize_start - data_start
+            stats.optimize_time = time.perf_counter() - optimize_start
+            stats.load_time = (stats.parse_time + stats.data_time +
+                               stats.optimize_time)
+
+    def use_program(self: Self, program: CESILProgram):
+        '''Runs "program", shared with any other CESIL instances using it,
+        in place of any loaded; VARIABLES start at 0 and DATA is read from
+        the start.  Raises ValueError if it is for the other language mode
+        (Standard or "Plus"), and VariableQuotaExceeded if it uses too many
+        VARIABLES.'''
+        if program.is_plus != self._is_plus:
+            raise ValueError('Program is for a different language mode')
+        for name in program.extensions:
+            if name not in self._extensions: self.load_extension(name)
+        if self._max_variables is not None:
+            self._variable_names = set()
+            for line in program.lines:
+                self._count_variable(line, line.line_number)
+        self._set_program(program)
+
+    def _set_program(self: Self, program: CESILProgram):
+        '''Sets up to run "program": its lines, LABELs and pure SUBROUTINEs
+        (in the form for this instance's options), VARIABLES and DATA'''
+        self._program = program
+        # The debugger shows the program as written, so is not optimized;
+        # and an output quota error must be reported at the line that
+        # output, so output is then not coalesced.
+        options = (self._optimize, self._optimize and self._max_output is None)
+        self._program_lines, self._labels = program.views[options]
+        self._pure_subroutines = {}
+        if self._memoize and self._debug_level == 0:
+            pure_subroutines = program._pure_subroutines.get(options)
+            if pure_subroutines is None:
+                pure_subroutines = program._pure_subroutines.setdefault(
+                    options, MappingProxyType(self._find_pure_subroutines()))
+            self._pure_subroutines = pure_subroutines
+
+        self._variables = dict.fromkeys(program.variables, 0)
+        self._data_values = program.data_values
+        self._data_ptr = 0
 
-        with open(filename, 'r') as reader:
-            for line in reader:
-                line_number += 1
-                # Skip blank lines and comments.
-                if self._is_blank(line) or self._is_comment(line): continue
-
-                if is_code_section == True:
-                    # Transition from Code to Data?
-                    if self._is_data_start(line):
-                        is_code_section = False
-                    else:
-                        # Process Code Line
-                        self._process_code_line(line, instruction_index,
-                                                line_number)
-                        instruction_index += 1
+    def _build_views(self: Self, lines: tuple[CodeLine, ...],
+                     labels: dict[str, int]) -> dict[tuple, tuple]:
+        '''Builds each form of a newly loaded program (see PROGRAM_VIEWS):
+        its lines and LABELs, optimized for those options'''
+        views = {}
+        for optimize, coalesce in PROGRAM_VIEWS:
+            self._program_lines, self._labels = list(lines), dict(labels)
+            if optimize: self._optimize_tail_calls()
+            if coalesce: self._coalesce_output()
+            # Share an earlier form if this one is no different
+            for view in views.values():
+                if (len(view[0]) == len(self._program_lines) and
+                        all(map(operator.is_, view[0], self._program_lines))
+                        and view[1] == self._labels):
+                    break
+            else:
+                view = (tuple(self._program_lines), self._labels)
+            views[(optimize, coalesce)] = view
+        return views
+
+    def convert(self: Self, lines: Iterable[str], source_format: str,
+                target_format: str) -> Iterator[str]:
+        '''Streams source lines converted to TEXT or CARD format'''
+        is_code_section = True
+        to_text = target_format[0].casefold() == 't'
+        line_format = '{0:<8}{1:<8} {2}' if to_text else '{0:<8}{1:<8}{2}'
+
+        lines = self._set_source_format(lines, source_format)
+        for line in lines:
+            if is_code_section and self._is_data_start(line):
+                is_code_section = False
+            # Comments, the data section and unparsable lines are unchanged
+            if (not is_code_section or self._is_blank(line) or
+                    self._is_comment(line)):
+                yield line
+                continue
+
+            label, instruction, operand = self._get_raw_line_parts(line)
+            if label is None and instruction is None:
+                yield line
+                continue
+
+            if not to_text and instruction is not None and operand:
+                # The CARD operand field is all of the rest of the line, so
+                # can't hold a trailing comment; drop it.
+                op_type = self._instructions[instruction][OPERAND_TYPE]
+                if op_type == OpType.NONE:
+                    operand = ''
+                elif op_type == OpType.LITERAL:
+                    operand = operand[:operand.rfind('"') + 1] or operand
                 else:
-                    # We're in the Data Section so process line as data values
-                    self._process_data_line(line)
+                    operand = operand.split()[0]
+            yield line_format.format(
+                label or '', instruction or '', operand).rstrip() + '\n'
+
+    def _set_source_format(
+            self: Self, lines: Iterable[str],
+            source_format: str) -> Iterable[str]:
+        '''Sets TEXT/CARD mode, sampling "lines" if format is AUTO, and
+        returns the lines, including any sampled, still to be processed'''
+        if source_format[0].casefold() != 'a':
+            self.set_source_format(source_format)
+            return lines
+
+        lines = iter(lines)
+        sample = list(islice(lines, FORMAT_SAMPLE_LINES))
+        self.set_source_format(source_format, sample)
+        return chain(sample, lines)
+
+    def set_source_format(self: Self, source_format: str,
+                          sample: Iterable[str] = ()):
+        '''Parses lines as TEXT or CARD format from now on; for AUTO, the
+        format of the "sample" lines'''
+        source_format = source_format[0].casefold()
+        if source_format == 'a':
+            self._is_text = self._detect_text_format(
+                list(islice(sample, FORMAT_SAMPLE_LINES)))
+        else:
+            self._is_text = source_format == 't'
+
+    def _detect_text_format(self: Self, sample: list[str]) -> bool:
+        '''True unless more "sample" code lines are only valid in CARD
+        column layout than are only valid as whitespace separated TEXT'''
+        text_only = card_only = 0
+        for line_number, line in enumerate(sample, 1):
+            if self._is_blank(line) or self._is_comment(line): continue
+            if self._is_data_start(line): break
+
+            is_text = self._is_valid_code_line(line, line_number, True)
+            is_card = self._is_valid_code_line(line, line_number, False)
+            if is_text and not is_card:
+                text_only += 1
+            elif is_card and not is_text:
+                card_only += 1
+
+        return card_only <= text_only
+
+    def _is_valid_code_line(
+            self: Self, line: str, line_number: int, is_text: bool) -> bool:
+        '''True if "line" parses to a LABEL and/or complete INSTRUCTION
+        using the TEXT (is_text) or CARD layout'''
+        self._is_text = is_text
+        try:
+            code_line = self._parse_code_line(line, line_number)
+        except CESILException:
+            return False
 
-    def run(self: Self):
-        '''Executes the current CESIL program.'''
-        # Iterate the "program" ...
-        self._instruction_ptr = 0
-        while self._instruction_ptr < len(self._program_lines):
-            # Output debug info, if enabled - for line ABOUT to execute!
-            if self._debug_level > 0: self._debug_out(self._debug_level)
+        if code_line.instruction is None:
+            # Label-only line; anything else on it isn't an instruction
+            return (code_line.label is not None and
+                    len(self._get_line_parts(line, line_number)) == 1)
+
+        op_type = self._instructions[code_line.instruction][OPERAND_TYPE]
+        return op_type == OpType.NONE or code_line.operand is not None
 
+    @property
+    def steps(self: Self) -> int:
+        '''Number of instructions executed by the last (or current) run'''
+        return self._steps
+
+    def set_data(self: Self, values: Iterable[int]):
+        '''Replaces the program's Data Section values'''
+        self._data_values = [int(value) for value in values]
+        self._data_ptr = 0
+
+    def run(self: Self, max_steps: int | None = None):
+        '''Executes the current CESIL program, optionally raising a
+        CESILException if it executes more than "max_steps" instructions.'''
+        # Find the registered callbacks for each hook ...
+        callbacks = {name: [getattr(hooks, name) for hooks in self._hooks
+                            if getattr(type(hooks), name) is not
+                            getattr(CESILHooks, name)] for name in HOOKS}
+
+        output = self._output if self._output is not None else sys.stdout
+        self._write = output.write
+        if callbacks['on_output']:
+            def write_hooked(text: str):
+                output.write(text)
+                for callback in callbacks['on_output']: callback(self, text)
+            self._write = write_hooked
+        if self._max_output is not None: self._limit_output()
+
+        instructions = self._instructions
+        if self._stats is not None: instructions = self._start_stats()
+        if self._detect_loops: instructions = self._start_loop_detection(
+            instructions)
+
+        # ... and iterate the "program", with the loop that needs.
+        self._instruction_ptr = 0
+        self._steps = 0
+        self._step_limit = max_steps if max_steps is not None else sys.maxsize
+        start = time.perf_counter()
+        self._trace_hooks = callbacks['on_trace']
+        try:
+            if any(callbacks[name] for name in STEP_HOOKS):
+                self._run_instrumented(callbacks, instructions)
+            else:
+                self._run_uninstrumented(instructions)
+        finally:
+            # Statistics of runs ending in an error are still recorded
+            if self._stats is not None:
+                self._finish_stats(time.perf_counter() - start)
+
+        for callback in callbacks['on_halt']: callback(self)
+
+    def run_cached(self: Self, cache: 'CESILResultCache',
+                   max_steps: int | None = None):
+        '''Runs the program as run() does, but reuses the output and final
+        status of an identical earlier run saved in "cache".  Only
+        deterministic runs (no INPUTN, RANDOM only with a seed, no hooks,
+        debugging, statistics or extensions) are cached; others just run.
+        Cached runs write their output when they end, and re-raise the
+        CESILException they ended with.  Runs ending in any other error,
+        or one that can't be saved, are not cached.'''
+        key = self._run_key(max_steps)
+        if key is None: return self.run(max_steps)
+
+        result = cache.get(key)
+        error = None
+        if result is None:
+            captured = io.StringIO()
+            output, self._output = self._output, captured
+            try:
+                self.run(max_steps)
+            except CESILException as err:
+                error = err
+            except BaseException:
+                # Not cached, but what the program output is still written
+                self._replay_output(output, captured.getvalue())
+                raise
+            finally:
+                self._output = output
+            result = {'output': captured.getvalue(), 'steps': self._steps,
+                      'error': self._saved_error(error)}
+            if error is None or result['error'] is not None:
+                cache.put(key, result)
+        elif result['error'] is not None:
+            name, args = result['error']
+            error = globals()[name](*args)
+
+        # Replayed output is written after the run, so from no one line
+        self._steps = result['steps']
+        self._current_line = None
+        self._replay_output(self._output, result['output'])
+        if error is not None: raise error
+
+    @staticmethod
+    def _replay_output(output: TextIO | None, text: str):
+        '''Writes a run's output to "output" (None for stdout)'''
+        (output if output is not None else sys.stdout).write(text)
+
+    @staticmethod
+    def _saved_error(error: CESILException | None) -> list | None:
+        '''"error" as its class name and arguments, to save with a cached
+        result; None if it can't be raised again exactly from those'''
+        if error is None or globals().get(type(error).__name__) is not type(
+                error):
+            return None
+        try:
+            saved = json.loads(json.dumps([type(error).__name__,
+                                           list(error.args)]))
+        except (TypeError, ValueError):
+            return None
+        return saved if saved[1] == list(error.args) else None
+
+    def _run_key(self: Self, max_steps: int | None) -> str | None:
+        '''Identifies a run by everything its result (output, error and
+        steps) depends on: program, data, language, options, quotas and
+        interpreter version.  None if the run may not give the same result
+        each time.'''
+        if self._program is None: return None
+        instructions = {line.instruction for line in self._program_lines}
+        if ('INPUTN' in instructions or self._hooks or self._extensions or
+                self._stats is not None or
+                ('RANDOM' in instructions and self._seed is None)):
+            return None
+
+        digest = hashlib.sha256()
+        digest.update(repr((
+            VERSION, self._program.program_hash,
+            self._data_values, self._is_plus, self._seed, max_steps,
+            self._optimize, self._memoize, self._max_stack, self._max_calls,
+            self._max_variables, self._max_output, self._detect_loops,
+            len(self._memory))).encode())
+        return digest.hexdigest()
+
+    def _start_loop_detection(
+            self: Self, instructions: dict[str, tuple]) -> dict[str, tuple]:
+        '''Starts detecting infinite loops, returning instructions where
+        INPUTN, RANDOM and extension instructions (whose effects may not
+        depend on the program state alone) restart detection'''
+        self._variables = HashedVariables(self._variables)
+        self._memory = HashedMemory(self._memory)
+        self._loop_state = None
+
+        def restarting(function: Callable) -> Callable:
+            def restart():
+                function()
+                self._loop_state = None
+            return restart
+
+        instructions = dict(instructions)
+        for mnemonic in {'INPUTN', 'RANDOM'} | self._extension_mnemonics:
+            if mnemonic not in instructions: continue
+            function, op_type = instructions[mnemonic]
+            instructions[mnemonic] = (restarting(function), op_type)
+        return instructions
+
+    def _check_loop_state(self: Self, head: int):
+        '''Compares the program state at a jump back to the LABEL at "head"
+        with the state saved by Brent's cycle detection, raising
+        InfiniteLoopDetected if they are the same'''
+        index = self._instruction_ptr
+        self._loop_span = (min(self._loop_span[0], head),
+                           max(self._loop_span[1], index))
+        key = (index, self._accumulator, self._variables.state_hash,
+               self._memory.state_hash, len(self._stack),
+               len(self._call_stack), self._data_ptr)
+
+        saved = self._loop_state
+        if (saved is not None and saved[0] == key and
+                saved[1] == self._variables and saved[2] == self._stack and
+                saved[3] == self._call_stack and saved[4] == self._memory):
+            first, last = self._loop_span
+            raise InfiniteLoopDetected(
+                self._current_line.line_number,
+                '{0} (line {1}) to line {2}'.format(
+                    self._program_lines[first].label,
+                    self._program_lines[first].line_number,
+                    self._program_lines[last].line_number))
+
+        self._loop_length += 1
+        if saved is None or self._loop_length == self._loop_power:
+            self._loop_power = 1 if saved is None else self._loop_power * 2
+            self._loop_length = 0
+            self._loop_state = (key, dict(self._variables), list(self._stack),
+                                list(self._call_stack), array(
+                                    MEMORY_TYPE, self._memory))
+            self._loop_span = (head, index)
+
+    def _limit_output(self: Self):
+        '''Makes output raise OutputQuotaExceeded, rather than write, once
+        more than the quota of bytes would have been output'''
+        write = self._write
+        output_bytes = 0
+        def write_limited(text: str):
+            nonlocal output_bytes
+            output_bytes += (len(text) if text.isascii() else
+                             len(text.encode()))
+            if output_bytes > self._max_output:
+                raise OutputQuotaExceeded(self._current_line.line_number,
+                                          output_bytes)
+            write(text)
+        self._write = write_limited
+
+    def collect_stats(self: Self):
+        '''Collects performance statistics (see stats) for the next load()
+        and run()'''
+        self._stats = CESILStats()
+
+    @property
+    def stats(self: Self) -> CESILStats | None:
+        return self._stats
+
+    def _start_stats(self: Self) -> dict[str, tuple]:
+        '''Starts collecting statistics, returning instructions that count
+        themselves, and the STACK and call stack depth, as they execute'''
+        stats = self._stats
+        counts = stats.mnemonic_counts
+        stack = self._stack
+        call_stack = self._call_stack
+
+        def counting(mnemonic: str, function: Callable) -> Callable:
+            counts[mnemonic] = 0
+            def count():
+                function()
+                counts[mnemonic] += 1
+                stats.peak_stack = max(stats.peak_stack, len(stack))
+                stats.peak_call_depth = max(stats.peak_call_depth,
+                                            len(call_stack))
+            return count
+
+        write = self._write
+        def write_counted(text: str):
+            stats.output_bytes += len(text.encode())
+            write(text)
+        self._write = write_counted
+
+        return {mnemonic: (counting(mnemonic, function), op_type)
+                for mnemonic, (function, op_type)
+                in self._instructions.items()}
+
+    def _finish_stats(self: Self, execution_time: float):
+        '''Records the load and run totals in the statistics'''
+        stats = self._stats
+        stats.execution_time = execution_time
+        stats.instructions = self._steps
+        if execution_time > 0:
+            stats.instructions_per_second = self._steps / execution_time
+        stats.mnemonic_counts = {mnemonic: count for mnemonic, count
+                                 in stats.mnemonic_counts.items() if count}
+        stats.memo_hits = self.memo_hits
+        stats.memo_misses = self.memo_misses
+        if resource is not None:
+            # Kilobytes, except on macOS
+            peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            stats.peak_rss = peak_rss if sys.platform == 'darwin' else (
+                peak_rss * 1024)
+
+    def _run_uninstrumented(self: Self, instructions: dict[str, tuple]):
+        '''Executes the program with no per-instruction hooks'''
+        program_lines = self._program_lines
+        while self._instruction_ptr < len(program_lines):
             # Get line to execute, and execute it ...
-            self._current_line = self._program_lines[self._instruction_ptr]
-            self._instructions[self._current_line.instruction][FUNCTION_PTR]()
+            self._current_line = program_lines[self._instruction_ptr]
+            self._steps += 1
+            if self._steps > self._step_limit: self._raise_step_limit()
+            instructions[self._current_line.instruction][FUNCTION_PTR]()
             # Handle accumulator overflow
-            if not self._is_legal_integer(self._accumulator):
-                raise CESILException(
-                    self._current_line.line_number,
-                    'Accumulator overlow; value out of range',
-                    self._accumulator
-                )
+            if not VALUE_MIN <= self._accumulator <= VALUE_MAX:
+                self._raise_overflow()
 
             # If halt is set, we quit exectuion immediately.
             if self._halt_execution: break
@@ -183,6 +1189,90 @@ class CESIL():
             # next instruction
             self._instruction_ptr += 1
 
+    def _run_instrumented(self: Self, callbacks: dict[str, list[Callable]],
+                          instructions: dict[str, tuple]):
+        '''Executes the program, calling the per-instruction hooks.
+        Memoization skips instructions, so is not used; nor are loop kernels,
+        unless every hooks object with per-instruction hooks is told what
+        they run by on_trace.'''
+        loop_kernels = self._loop_kernels
+        trace_counts = self._trace_counts
+        if not all(getattr(type(hooks), 'on_trace') is not CESILHooks.on_trace
+                   for hooks in self._hooks
+                   if any(getattr(type(hooks), name) is not
+                          getattr(CESILHooks, name) for name in STEP_HOOKS)):
+            self._loop_kernels = {}
+            self._trace_counts = None
+        pure_subroutines, self._pure_subroutines = self._pure_subroutines, {}
+        try:
+            self._run_hooked(callbacks, instructions)
+        finally:
+            self._loop_kernels = loop_kernels
+            self._trace_counts = trace_counts
+            self._pure_subroutines = pure_subroutines
+
+    def _run_hooked(self: Self, callbacks: dict[str, list[Callable]],
+                    instructions: dict[str, tuple]):
+        '''Instrumented run loop; see _run_uninstrumented()'''
+        on_step = callbacks['on_step']
+        on_branch = callbacks['on_branch']
+        on_call = callbacks['on_call']
+        on_return = callbacks['on_return']
+        on_variable_write = callbacks['on_variable_write']
+        on_input = callbacks['on_input']
+
+        program_lines = self._program_lines
+        while self._instruction_ptr < len(program_lines):
+            index = self._instruction_ptr
+            line = self._current_line = program_lines[index]
+            self._steps += 1
+            if self._steps > self._step_limit: self._raise_step_limit()
+            for callback in on_step: callback(self, index, line)
+
+            call_depth = len(self._call_stack)
+            instructions[line.instruction][FUNCTION_PTR]()
+            if not VALUE_MIN <= self._accumulator <= VALUE_MAX:
+                self._raise_overflow()
+
+            # Report what the instruction did
+            instruction = line.instruction
+            if instruction in BRANCH_INSTRUCTIONS:
+                for callback in on_branch:
+                    callback(self, index, line, self._branch)
+                if len(self._call_stack) > call_depth:
+                    for callback in on_call:
+                        callback(self, index, self._instruction_ptr)
+            elif instruction == 'RETURN':
+                for callback in on_return:
+                    callback(self, index, self._instruction_ptr)
+            elif instruction == 'STORE':
+                for callback in on_variable_write:
+                    callback(self, line.operand, self._accumulator)
+            elif instruction in INPUT_INSTRUCTIONS:
+                for callback in on_input: callback(self, self._accumulator)
+
+            if self._halt_execution: break
+            if self._branch:
+                self._branch = False
+                continue
+            self._instruction_ptr += 1
+
+    def _raise_step_limit(self: Self):
+        '''Raises the step limit exception for the current line'''
+        raise CESILException(
+            self._current_line.line_number,
+            'Step limit exceeded; too many instructions executed',
+            self._step_limit
+        )
+
+    def _raise_overflow(self: Self):
+        '''Raises the accumulator overflow exception for the current line'''
+        raise CESILException(
+            self._current_line.line_number,
+            'Accumulator overlow; value out of range',
+            self._accumulator
+        )
+
     def _process_code_line(
             self: Self, line: str, instruction_index: int, line_number: int):
         '''Process a line of source code, and add it to the Program'''
@@ -201,11 +1291,407 @@ class CESIL():
             # Add the variable and initialize it
             self._variables[code_line.operand] = 0
 
+        if self._max_variables is not None:
+            self._count_variable(code_line, line_number)
+
         # Add a code line to the program if there's an instruction
         if code_line.instruction != None:
-            code_line.line_number = line_number
             self._program_lines.append(code_line)
 
+    def _count_variable(self: Self, code_line: CodeLine, line_number: int):
+        '''Counts distinct VARIABLES (including those only STOREd), raising
+        VariableQuotaExceeded if there are more than the quota'''
+        if (self._is_legal_identifier(code_line.operand) and
+                self._instructions[code_line.instruction][OPERAND_TYPE] in
+                (OpType.LITERAL_VAR, OpType.VAR)):
+            self._variable_names.add(code_line.operand)
+            if len(self._variable_names) > self._max_variables:
+                raise VariableQuotaExceeded(line_number, code_line.operand)
+
+    def _optimize_tail_calls(self: Self):
+        '''Replaces subroutine calls that are directly followed by RETURN
+        with plain jumps; the subroutine's own RETURN then returns straight
+        to our caller, so no call stack frame is needed'''
+        for index in range(len(self._program_lines) - 1):
+            line = self._program_lines[index]
+            if (line.instruction in TAIL_CALL_JUMPS and
+                    self._program_lines[index + 1].instruction == 'RETURN'):
+                self._program_lines[index] = CodeLine(
+                    line.label, TAIL_CALL_JUMPS[line.instruction],
+                    line.operand, line.line_number)
+
+    def _coalesce_output(self: Self):
+        '''Replaces runs of instructions with constant output (PRINT, LINE,
+        and OUT or OUTCHAR of a LOADed LITERAL) with a single PRINT of all
+        of it, then a LOAD of the ACCUMULATOR value the run leaves, if it
+        LOADs one.  Runs never include an instruction a LABEL points to
+        (on its own line or not) after their first, so no jump lands inside
+        one.  The PRINT keeps the lines it replaces, so the steps they take
+        are still counted (see _count_coalesced()).'''
+        lines = self._program_lines
+        targets = set(self._labels.values())
+        program = []
+        new_indexes = []
+        index = 0
+        while index < len(lines):
+            end, text, load = self._constant_output_run(index, targets)
+            if end - index > 1 + (load is not None):
+                new_indexes.extend([len(program)] * (end - index))
+                folded = tuple(lines[index:end])
+                counted = [line.instruction for line in folded]
+                if load is not None: counted.remove('LOAD')
+                program.append(CoalescedLine(
+                    lines[index].label, 'PRINT', text,
+                    lines[index].line_number, folded, tuple(counted)))
+                if load is not None:
+                    program.append(CodeLine(None, 'LOAD', load.operand,
+                                            load.line_number))
+                index = end
+            else:
+                new_indexes.append(len(program))
+                program.append(lines[index])
+                index += 1
+        # A LABEL after the last instruction points past the end
+        new_indexes.append(len(program))
+
+        if len(program) < len(lines):
+            self._program_lines = program
+            self._labels = {label: new_indexes[index]
+                            for label, index in self._labels.items()}
+
+    def _constant_output_run(
+            self: Self, start: int,
+            targets: set[int]) -> tuple[int, str, CodeLine | None]:
+        '''Finds the run of constant output starting at "start", ending
+        before any jump "targets" (see _coalesce_output()); returns the
+        index after it, its output and its last LOAD line (None if it has
+        none)'''
+        lines = self._program_lines
+        accumulator = None
+        pieces = []
+        load = None
+        index = start
+        while index < len(lines):
+            line = lines[index]
+            if index > start and index in targets: break
+            if line.instruction == 'LOAD' and type(line.operand) is int:
+                accumulator = line.operand
+                load = line
+            elif line.instruction == 'PRINT':
+                pieces.append(line.operand)
+            elif line.instruction == 'LINE':
+                pieces.append('\n')
+            elif line.instruction == 'OUT' and accumulator is not None:
+                pieces.append(str(accumulator))
+            elif (line.instruction == 'OUTCHAR' and accumulator is not None
+                    and 0 <= accumulator <= sys.maxunicode):
+                pieces.append(chr(accumulator))
+            else:
+                break
+            index += 1
+
+        return index, ''.join(pieces), load
+
+    def apply_profile(self: Self, profile: 'CESILProfile'):
+        '''Compiles the loops "profile", of earlier runs of this program,
+        shows are hot; each as a trace of the way its jumps most often went'''
+        if not self._optimize: return
+        if profile.program_hash != CESILCoverage.hash_program(
+                self._program_lines, self._labels):
+            raise ValueError('Profile is for a different program')
+
+        for index, line in enumerate(self._program_lines):
+            head = self._labels.get(line.operand)
+            if (line.instruction in TRACE_JUMPS and head is not None and
+                    head <= index and
+                    profile.taken[index] >= PROFILE_HOT_COUNT):
+                trace = self._find_trace(head, profile)
+                if trace is not None:
+                    self._add_loop_kernel(trace)
+
+    def _find_trace(self: Self, head: int,
+                    profile: 'CESILProfile') -> list[tuple[int, bool]] | None:
+        '''Follows the way each jump most often went, in "profile", from the
+        LABEL at "head".  Returns the path, as (index, jump taken) pairs, if
+        a jump leads back to "head" through instructions a trace can run.'''
+        lines = self._program_lines
+        trace = []
+        index = head
+        while len(trace) < MAX_TRACE_LENGTH and index < len(lines):
+            instruction = lines[index].instruction
+            if instruction == 'JUMP':
+                taken = True
+            elif instruction in KERNEL_CONDITIONS:
+                taken = profile.taken[index] > profile.not_taken[index]
+            elif (instruction in KERNEL_STATEMENTS or
+                    instruction in self._trace_output):
+                taken = False
+            else:
+                return None
+
+            trace.append((index, taken))
+            if not taken:
+                index += 1
+                if index == head: return None
+            else:
+                index = self._labels.get(lines[index].operand)
+                if index is None: return None
+                if index == head: return trace
+
+        return None
+
+    def _count_back_edge(self: Self) -> tuple[Callable, int] | None:
+        '''Counts a taken jump back to a loop's LABEL and, once the loop is
+        hot, records and compiles a trace of it; returns the compiled kernel
+        if this jump closes the trace'''
+        index = self._instruction_ptr
+        head = self._labels[self._current_line.operand]
+        if head > index: return None
+        count = self._trace_counts.get(index, 0) + 1
+        self._trace_counts[index] = count
+        if count < TRACE_THRESHOLD: return None
+
+        trace = self._record_trace(head)
+        if trace is None:
+            self._trace_counts[index] = TRACE_THRESHOLD - TRACE_RETRY
+            return None
+        # The trace may close with another jump back to the same LABEL
+        self._add_loop_kernel(trace)
+        del self._trace_counts[index]
+        return self._loop_kernels.get(index)
+
+    def _record_trace(self: Self, head: int) -> list[tuple[int, bool]] | None:
+        '''Records the path the next iteration of the loop at "head" takes,
+        by running it on a copy of the current state.  Returns the path, as
+        (index, jump taken) pairs, if it jumps back to "head" through
+        instructions a trace can run, without raising an error.'''
+        lines = self._program_lines
+        accumulator = self._accumulator
+        variables, self._variables = self._variables, dict(self._variables)
+        current_line = self._current_line
+        write, self._write = self._write, lambda text: None
+        trace = []
+        index = head
+        try:
+            while len(trace) < MAX_TRACE_LENGTH and index < len(lines):
+                line = self._current_line = lines[index]
+                instruction = line.instruction
+                if instruction == 'JUMP':
+                    taken = True
+                elif instruction == 'JIZERO':
+                    taken = self._accumulator == 0
+                elif instruction == 'JINEG':
+                    taken = self._accumulator < 0
+                elif (instruction in KERNEL_STATEMENTS or
+                        instruction in self._trace_output):
+                    taken = False
+                    # Output is discarded, so PRINT has nothing to do
+                    if instruction != 'PRINT':
+                        self._instructions[instruction][FUNCTION_PTR]()
+                    if not VALUE_MIN <= self._accumulator <= VALUE_MAX:
+                        return None
+                else:
+                    return None
+
+                trace.append((index, taken))
+                if not taken:
+                    index += 1
+                    if index == head: return None
+                else:
+                    index = self._labels.get(line.operand)
+                    if index is None: return None
+                    if index == head: return trace
+        except (KeyError, ZeroDivisionError, ValueError, OverflowError):
+            return None
+        finally:
+            self._accumulator = accumulator
+            self._variables = variables
+            self._current_line = current_line
+            self._write = write
+
+        return None
+
+    def _add_loop_kernel(self: Self, trace: list[tuple[int, bool]]):
+        '''Compiles "trace", to run from the jump that closes it, with the
+        instructions an iteration runs (for steps and statistics) and the
+        trace itself (for on_trace hooks)'''
+        mnemonics = []
+        for index, _ in trace:
+            line = self._program_lines[index]
+            if type(line) is CoalescedLine:
+                mnemonics.extend(line.counted)
+            else:
+                mnemonics.append(line.instruction)
+        self._loop_kernels[trace[-1][0]] = (self._compile_trace(trace),
+                                            mnemonics, trace)
+
+    def _compile_trace(self: Self, trace: list[tuple[int, bool]]) -> Callable:
+        '''Compiles a path once around a loop, from its LABEL to the jump
+        back to it, to a function that runs whole iterations up to a limit.
+        "trace" lists the instructions, by index, and whether each jump on
+        the path is taken.  An iteration that would leave the path, overflow,
+        divide by zero or output an illegal character is abandoned (its
+        variables and output discarded), so normal stepping resumes at the
+        LABEL and takes the other way, or raises the error, at the right line.
+        If the final jump falls through, its iteration is kept, and the loop
+        ends.
+
+        Returns (ACCUMULATOR, True if the loop should continue stepping,
+        number of iterations run)'''
+        lines = [(self._program_lines[index], taken) for index, taken in trace]
+        statements = [line for line, _ in lines
+                      if line.instruction in KERNEL_STATEMENTS]
+        reads = {line.operand for line in statements
+                 if line.instruction != 'STORE' and
+                 self._is_legal_identifier(line.operand)}
+        writes = {line.operand for line in statements
+                  if line.instruction == 'STORE'}
+        has_output = any(line.instruction in TRACE_OUTPUT
+                         for line, _ in lines)
+        check = 'if not {0} <= a <= {1}: break'.format(VALUE_MIN, VALUE_MAX)
+
+        # Values are only guaranteed to be integers (as the interpreter
+        # treats them) if they start as integers; otherwise, don't compile.
+        source = ['def kernel(acc, variables, limit, write):',
+                  '    if type(acc) is not int: return acc, True, 0']
+        for name in sorted(reads | writes):
+            source.append('    v_{0} = variables.get({0!r})'.format(name))
+        for name in sorted(reads):
+            source.append(
+                '    if type(v_{0}) is not int: return acc, True, 0'.format(
+                    name))
+        source += ['    looping = True', '    iterations = 0', '    try:',
+                   '        while iterations < limit:', '            a = acc']
+        source += ['            t_{0} = v_{0}'.format(name)
+                   for name in sorted(writes)]
+        if has_output: source.append('            out = []')
+        for line, taken in lines[:-1]:
+            instruction = line.instruction
+            if instruction in KERNEL_CONDITIONS:
+                source.append('            if {0}({1}): break'.format(
+                    'not ' if taken else '', KERNEL_CONDITIONS[instruction]))
+            elif instruction in TRACE_OUTPUT:
+                source.append('            out.append({0})'.format(
+                    TRACE_OUTPUT[instruction].format(line.operand)))
+            elif instruction in KERNEL_STATEMENTS:
+                operand = line.operand
+                if self._is_legal_identifier(operand):
+                    operand = ('t_' if operand in writes else 'v_') + operand
+                statement = KERNEL_STATEMENTS[instruction].format(operand)
+                source.append('            ' + statement)
+                if statement.startswith('a ') and statement[2] != '=':
+                    source.append('            ' + check)
+
+        source += ['            acc = a', '            iterations += 1']
+        source += ['            v_{0} = t_{0}'.format(name)
+                   for name in sorted(writes)]
+        if has_output:
+            source.append('            for text in out: write(text)')
+        last = lines[-1][0].instruction
+        if last in KERNEL_CONDITIONS:
+            source += ['            if not ({0}):'.format(
+                           KERNEL_CONDITIONS[last]),
+                       '                looping = False',
+                       '                break']
+        source += [
+            '    except (ZeroDivisionError, ValueError, OverflowError):',
+            '        pass', '    finally:']
+        source += [
+            '        if v_{0} is not None: variables[{0!r}] = v_{0}'.format(
+                name) for name in sorted(writes)]
+        if not writes: source.append('        pass')
+        source.append('    return acc, looping, iterations')
+
+        namespace = {}
+        exec('\n'.join(source), namespace)
+        return namespace['kernel']
+
+    def _find_pure_subroutines(self: Self) -> dict[int, tuple]:
+        '''Finds SUBROUTINEs whose result depends only on the ACCUMULATOR
+        and known VARIABLES (no I/O, RANDOM or HALT; STACK use is checked as
+        they run); returns, by entry index, the VARIABLES their cache entries
+        are keyed by, and those they must record'''
+        lines = self._program_lines
+        calls = [index for index, line in enumerate(lines)
+                 if line.instruction in SUBROUTINE_CALLS]
+        pure_subroutines = {}
+        if not calls: return pure_subroutines
+        live_in = self._find_live_variables()
+
+        for entry in {self._labels.get(lines[call].operand) for call in calls}:
+            if entry is None: continue
+            # Every path from the entry must be pure and end with a RETURN
+            reachable = set()
+            pending = [entry]
+            while pending:
+                index = pending.pop()
+                if index in reachable: continue
+                if index >= len(lines): break
+                if lines[index].instruction not in PURE_INSTRUCTIONS: break
+                reachable.add(index)
+                pending.extend(self._successors(index))
+            else:
+                # Record every VARIABLE written, plus those read before
+                # written, so results can be reused.
+                outputs = tuple(sorted(
+                    {lines[index].operand for index in reachable
+                     if lines[index].instruction == 'STORE'}))
+                inputs = tuple(sorted(live_in[entry].union(outputs)))
+                pure_subroutines[entry] = (inputs, outputs)
+
+        return pure_subroutines
+
+    def _find_live_variables(self: Self) -> list[set]:
+        '''Finds the VARIABLES that may be read, before being written, from
+        each instruction on, up to the RETURN that ends its SUBROUTINE; all
+        a cache entry of the SUBROUTINE needs.  A worklist passes reads back
+        along the flow graph, so the cost is linear in the program's size
+        (for each VARIABLE).'''
+        lines = self._program_lines
+        predecessors = [[] for _ in lines]
+        for index in range(len(lines)):
+            for successor in self._successors(index):
+                if successor < len(lines):
+                    predecessors[successor].append(index)
+
+        live_in = [set() for _ in lines]
+        changes = deque()
+        for index, line in enumerate(lines):
+            op_type = self._instructions[line.instruction][OPERAND_TYPE]
+            if (op_type == OpType.LITERAL_VAR and
+                    self._is_legal_identifier(line.operand)):
+                live_in[index].add(line.operand)
+                changes.append((index, {line.operand}))
+
+        # Sets only grow, so just what was added to each is passed back to
+        # its predecessors; a VARIABLE reaches each instruction at most once.
+        while changes:
+            index, added = changes.popleft()
+            for predecessor in predecessors[index]:
+                new = added - live_in[predecessor]
+                if lines[predecessor].instruction == 'STORE':
+                    new.discard(lines[predecessor].operand)
+                if new:
+                    live_in[predecessor] |= new
+                    changes.append((predecessor, new))
+
+        return live_in
+
+    def _successors(self: Self, index: int) -> list[int]:
+        '''Instruction indexes that may execute after the one at "index",
+        within its SUBROUTINE (so none after RETURN)'''
+        line = self._program_lines[index]
+        if line.instruction in ('HALT', 'RETURN'): return []
+        if line.instruction == 'JUMP':
+            return [self._labels[line.operand]] if (
+                line.operand in self._labels) else []
+        successors = [index + 1]
+        if (line.instruction in CONDITIONAL_JUMPS or
+                line.instruction == 'JUMPSR') and line.operand in self._labels:
+            successors.append(self._labels[line.operand])
+
+        return successors
+
     def _process_data_line(self: Self, line: str):
         '''Adds any data on this line to our data values.'''
         if line[0] != END_FILE:
@@ -223,12 +1709,12 @@ class CESIL():
 
         if self._is_legal_identifier(parts[current_part]):
             # We have a label ...
-            label = parts[current_part]
+            label = sys.intern(parts[current_part])
             if current_part < last_part: current_part += 1
 
         if self._is_instruction(parts[current_part]):
             # We have an instruction
-            instruction = parts[current_part]
+            instruction = sys.intern(parts[current_part])
             op_type = self._instructions[instruction][OPERAND_TYPE]
 
             # Get the Operand if there is one.
@@ -237,29 +1723,75 @@ class CESIL():
                 potential_operand = parts[current_part]
 
                 if op_type == OpType.LITERAL:
-                    # Only applies to PRINT, which needs special handling.
-                    # Put SPLIT parts back together for PRINT "" strings
-                    while current_part < last_part:
-                        current_part += 1
-                        potential_operand += ' ' + parts[current_part]
-
-                    # Strip Quotes and any trailing comment.
-                    operand = potential_operand[potential_operand.find('"')+1:
-                                                potential_operand.rfind('"')]
+                    # Only applies to PRINT; the line splitters leave the
+                    # string as written.  Strip Quotes and any trailing
+                    # comment.
+                    operand = sys.intern(potential_operand[
+                        potential_operand.find('"')+1:
+                        potential_operand.rfind('"')])
                 else:
                     # Validate and get the label, literal or variable
                     operand = self._get_lab_lit_var(
                         op_type, potential_operand, line_number)
 
-        return CodeLine(label, instruction, operand)
+        return CodeLine(label, instruction, operand, line_number)
 
     def _get_line_parts(self: Self, line: str, line_number: int) -> list[str]:
         '''Split line into parts based on TEXT/CARD formatting'''
         if self._is_text:
-            return line.split()
+            return self._split_text_line(line)
         else:
             return self._split_card_line(line, line_number)
 
+    def _split_text_line(self: Self, line: str) -> list[str]:
+        '''Splits code line on whitespace, in one pass, keeping LITERAL
+        (PRINT) operands exactly as written'''
+        match = TEXT_LINE_PATTERN.match(line)
+        parts = [part for part in match.groups() if part is not None]
+
+        # A LITERAL instruction is either the first or second (after a label)
+        # part; its operand is everything that follows it on the line.
+        for index in range(min(2, len(parts) - 1)):
+            instruction = self._instructions.get(parts[index])
+            if instruction is not None:
+                if instruction[OPERAND_TYPE] == OpType.LITERAL:
+                    return parts[:index + 1] + [
+                        line[match.start(index + 2):].rstrip()]
+                break
+
+        return parts
+
+    def _get_raw_line_parts(
+            self: Self, line: str) -> tuple[str | None, str | None, str]:
+        '''Gets the LABEL, INSTRUCTION and unparsed OPERAND text (including
+        any trailing comment) from a line, for TEXT/CARD conversion'''
+        # Each token is paired with the raw text that follows it
+        if self._is_text:
+            match = TEXT_LINE_PATTERN.match(line)
+            tokens = [(part, line[match.end(index + 1):]) for index, part
+                      in enumerate(match.groups()) if part is not None]
+        elif len(line) <= INSTRUCTION_COL_START:
+            tokens = [(line.strip(), '')]
+        else:
+            label = line[LABEL_COL_START:INSTRUCTION_COL_START].strip()
+            tokens = [(label, '')] if len(label) > 0 else []
+            tokens.append((
+                line[INSTRUCTION_COL_START:OPERAND_COL_START].strip(),
+                line[OPERAND_COL_START:]))
+
+        label = instruction = None
+        current_part = 0
+        if self._is_legal_identifier(tokens[0][0]):
+            label = tokens[0][0]
+            if len(tokens) > 1: current_part += 1
+        if self._is_instruction(tokens[current_part][0]):
+            instruction = tokens[current_part][0]
+        elif current_part > 0:
+            # Something other than an instruction follows the label
+            return None, None, ''
+
+        return label, instruction, tokens[current_part][1].strip()
+
     def _get_lab_lit_var(
             self: Self, op_type: OpType, potential_operand: str,
             line_number: str) -> int | str:
@@ -269,13 +1801,14 @@ class CESIL():
         # If LABEL, then it's easy.
         if (op_type == OpType.LABEL
                 and self._is_legal_identifier(potential_operand)):
-            operand = potential_operand
+            operand = sys.intern(potential_operand)
         elif op_type == OpType.LITERAL_VAR or op_type == OpType.VAR:
             # If a LITERAL, convert to an integer.
             if self._is_legal_identifier(potential_operand):
-                operand = potential_operand
+                operand = sys.intern(potential_operand)
             elif self._is_legal_integer(potential_operand):
-                operand = int(potential_operand)
+                value = int(potential_operand)
+                operand = self._literals.setdefault(value, value)
             else:
                 raise CESILException(
                     line_number, 'Illegal operand', potential_operand)
@@ -301,7 +1834,7 @@ class CESIL():
             # We have an operand ...
             operand = line[OPERAND_COL_START:].strip()
             # If the operand is a string, make sure it is terminated with ".
-            if operand[0] == '"' and operand.find('"', 1) <= 0:
+            if operand[:1] == '"' and operand.find('"', 1) <= 0:
                 raise CESILException(
                     line_number, 'Unterminated String', operand)
             
@@ -334,12 +1867,11 @@ class CESIL():
 
     def _is_legal_identifier(self: Self, identifier: str) -> bool:
         '''Determines if the "identifier" is legal in CESIL'''
-        if self._is_instruction(identifier):
+        if not isinstance(identifier, str) or self._is_instruction(identifier):
             # Instructions are RESERVED words and NOT legal identifiers!
             return False
         else:
-            return re.fullmatch(
-                IDENTIFIER_PATTERN, str(identifier)) is not None
+            return IDENTIFIER_PATTERN.fullmatch(identifier) is not None
 
     def _is_instruction(self: Self, instruction: str) -> bool:
         '''True if "instruction" is a valid CESIL/Plus instruction'''
@@ -351,22 +1883,63 @@ class CESIL():
 
     def _register_instructions(self: Self):
         '''Registers decorated Python methods as CESIL Instructions'''
-        # Inspect functions (callable methods) through class attributes ...
-        functions = [atr for atr in dir(CESIL) if callable(getattr(self, atr))]
-        for function_name in functions:
+        # Inspect functions through class attributes, once, for those that
+        # are CESIL functions; decorated w/ @instruction (has __mnemonic) ...
+        if CESIL._instruction_methods is None:
+            CESIL._instruction_methods = [
+                atr for atr in dir(CESIL) if getattr(
+                    getattr(CESIL, atr), '_CESIL__mnemonic', None) != None]
+        for function_name in CESIL._instruction_methods:
             function = getattr(self, function_name)
-            # CESIL function only if decorated w/ @instruction (has __mnemonic)
-            if getattr(function, '_CESIL__mnemonic', None) != None:
-                # Only add "PLUS" instructions if in PLUS mode
-                if function.__is_plus and not self._is_plus: continue
-
-                self._instructions[function.__mnemonic] = (
-                    function, function.__op_type)
+            # Only add "PLUS" instructions if in PLUS mode
+            if function.__is_plus and not self._is_plus: continue
+
+            self._instructions[function.__mnemonic] = (
+                function, function.__op_type)
+
+    def load_extension(self: Self, name: str):
+        '''Registers the extension instructions of plugin "name": an
+        installed "cesil.extensions" entry point, an importable module or a
+        .py file.  Plugins define instructions as functions (taking the
+        CESIL instance) decorated with @CESIL.instruction; "Plus" ones only
+        register in "Plus" mode.  Load extensions before the program.'''
+        module = self._import_extension(name)
+        for function in vars(module).values():
+            mnemonic = getattr(function, '_CESIL__mnemonic', None)
+            if mnemonic is None or not callable(function): continue
+            if function._CESIL__is_plus and not self._is_plus: continue
+            if mnemonic in self._instructions:
+                raise ValueError('Instruction {0} is already defined'.format(
+                    mnemonic))
+
+            self._instructions[mnemonic] = (
+                MethodType(function, self), function._CESIL__op_type)
+            self._extension_mnemonics.add(mnemonic)
+        self._extensions.append(name)
+
+    @staticmethod
+    def _import_extension(name: str) -> ModuleType:
+        '''Imports the plugin module "name" (see load_extension())'''
+        if name.endswith('.py'):
+            module_name = os.path.splitext(os.path.basename(name))[0]
+            spec = importlib.util.spec_from_file_location(module_name, name)
+            if spec is None:
+                raise ImportError('Cannot load extension ' + name)
+            module = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(module)
+            return module
+
+        for entry_point in importlib.metadata.entry_points(
+                group=EXTENSION_GROUP):
+            if entry_point.name == name: return entry_point.load()
+        return importlib.import_module(name)
 
     # Debugger Methods
 
-    def _debug_out(self: Self, level: int):
-        '''Debug Output'''
+    def _debug_out(self: Self, level: int,
+                   changes: tuple[dict[str, int], int] | None = None):
+        '''Debug Output; verbose output shows only the VARIABLES changed,
+        and how the STACK changed from "changes[1]" entries, if given'''
         # Just exit if we're not in debug mode ...
         if level == 0: return
 
@@ -383,12 +1956,18 @@ class CESIL():
                                     label, line.instruction, operand), end='')
 
         # Add Verbose output?
-        if level >= 3: self._ouput_stack_variable_detail()
+        if level >= 3:
+            if changes is None:
+                self._ouput_stack_variable_detail()
+            else:
+                self._output_stack_variable_changes(*changes)
 
         # Pause for [Enter]?
         if level == 2 or level == 4:
-            # This results in a new-line from the [Enter] key ...
-            input()
+            # This results in a new-line from the [Enter] key; "D" shows the
+            # full STACK and VARIABLES first.
+            while input().strip().casefold() == DEBUG_FULL_DUMP:
+                self._ouput_stack_variable_detail()
         else:
             # ... otherwise we need to output our own new-line.
             print('')
@@ -411,35 +1990,41 @@ class CESIL():
 
     def _ouput_stack_variable_detail(self: Self):
         '''Outputs details for STACK and VARIABLE values.'''
-        print('\n\n\t[Stack:                 ] [Variable :    Value]')
-
-        # Which list has more items in it, the stack or the variable list?
-        longest_list = max(len(self._stack), len(self._variables))
-        index = 0
-        while index < longest_list:
-            stack_item = stack_pos = ''
-            variable_name = variable_value = var_str = ''
-
-            # Do current stack item, if there is one.
-            if index < len(self._stack):
-                stack_idx = (len(self._stack) - index) - 1
-                stack_item = self._stack[stack_idx]
-                if stack_idx == len(self._stack) - 1:
-                    stack_pos = '-> (Top)'
-                elif stack_idx == 0:
-                    stack_pos = '-> (Bottom)'
-
-            stack_str = '{0:>13} {1:<11}'.format(stack_item, stack_pos)
-
-            # Do next variable, if there is one.
-            if index < len(self._variables):
-                variable_name = list(self._variables)[index - 1]
-                variable_value = self._variables[variable_name]
-                var_str = '{0:>6} : {1:>8}'.format(variable_name,
-                                                   variable_value)
-
+        stack_rows = []
+        for stack_idx in range(len(self._stack) - 1, -1, -1):
+            stack_pos = ''
+            if stack_idx == len(self._stack) - 1:
+                stack_pos = '-> (Top)'
+            elif stack_idx == 0:
+                stack_pos = '-> (Bottom)'
+            stack_rows.append((self._stack[stack_idx], stack_pos))
+
+        self._output_detail_rows(DEBUG_DETAIL_HEADER, stack_rows,
+                                 self._variables.items())
+
+    def _output_stack_variable_changes(
+            self: Self, variables: dict[str, int], stack_depth: int):
+        '''Outputs the VARIABLES written, and new STACK top (if the STACK
+        was "stack_depth" entries deep), since the last instruction'''
+        stack_rows = []
+        if len(self._stack) != stack_depth:
+            stack_rows.append((self._debug_get_top_of_stack(), '-> (Top)'))
+
+        if stack_rows or variables:
+            self._output_detail_rows(DEBUG_CHANGES_HEADER, stack_rows,
+                                     variables.items())
+
+    def _output_detail_rows(self: Self, header: str,
+                            stack_rows: list[tuple[int, str]],
+                            variables: Iterable[tuple[str, int]]):
+        '''Outputs STACK entries and VARIABLES side by side'''
+        print(header)
+        for stack_row, variable in zip_longest(stack_rows, variables):
+            stack_str = '{0:>13} {1:<11}'.format(*(stack_row or ('', '')))
+            var_str = ''
+            if variable is not None:
+                var_str = '{0:>6} : {1:>8}'.format(*variable)
             print('{0:>32}  {1:>20}'.format(stack_str, var_str))
-            index += 1
 
     def _debug_get_formatted_operand(self: Self, line: str) -> int | str:
         '''# Extracts and formats an operand for DEBUG output'''
@@ -461,6 +2046,9 @@ class CESIL():
     @instruction("IN", OpType.NONE, False)
     def _in_cesil(self: Self):
         '''Inputs the next DATA ITEM and puts it in the ACCUMULATOR'''
+        if self._data_ptr >= len(self._data_values):
+            raise CESILException(self._current_line.line_number,
+                                 'No more DATA values', 'IN')
         self._accumulator = int(self._data_values[self._data_ptr])
         self._data_ptr += 1
 
@@ -469,7 +2057,7 @@ class CESIL():
         '''Ouputs ACCUMULATOR value, without ending the LINE'''
         # End the line if we are in debug mode
         new_line = '\n' if self._debug_level > 0 else ''
-        print(self._accumulator, end=new_line)
+        self._write(str(self._accumulator) + new_line)
 
     @instruction("LOAD", OpType.LITERAL_VAR, False)
     def _load_cesil(self: Self):
@@ -485,14 +2073,37 @@ class CESIL():
     @instruction("LINE", OpType.NONE, False)
     def _line(self: Self):
         '''Move to a new LINE (EOL)'''
-        print('')
+        self._write('\n')
 
     @instruction("PRINT", OpType.LITERAL, False)
     def _print_cesil(self: Self):
         '''Prints LITERAL on the current LINE'''
+        line = self._current_line
+        if type(line) is CoalescedLine: self._count_coalesced(line)
         # End the line if we are in debug mode
         new_line = '\n' if self._debug_level > 0 else ''
-        print(self._current_line.operand, end=new_line)
+        self._write(line.operand + new_line)
+
+    def _count_coalesced(self: Self, line: CoalescedLine):
+        '''Counts the steps (and instructions, in statistics) of the lines
+        a coalesced PRINT runs in place of.  If they pass the step limit,
+        runs those lines one at a time instead, to stop at the right one.'''
+        if self._steps + len(line.counted) - 1 > self._step_limit:
+            self._steps -= 1
+            for folded in line.folded:
+                self._current_line = folded
+                self._steps += 1
+                if self._steps > self._step_limit: self._raise_step_limit()
+                self._instructions[folded.instruction][FUNCTION_PTR]()
+                if self._stats is not None:
+                    self._stats.mnemonic_counts[folded.instruction] += 1
+
+        self._steps += len(line.counted) - 1
+        if self._stats is not None:
+            counts = self._stats.mnemonic_counts
+            # The PRINT itself is counted as it runs
+            counts['PRINT'] -= 1
+            for mnemonic in line.counted: counts[mnemonic] += 1
 
     @instruction("ADD", OpType.LITERAL_VAR, False)
     def _add(self: Self):
@@ -517,22 +2128,48 @@ class CESIL():
     @instruction("JUMP", OpType.LABEL, False)
     def _jump(self: Self):
         '''Jumps to the INSTRUCTION at LABEL'''
-        self._instruction_ptr = self._labels[self._current_line.operand]
-        self._branch = True
+        self._loop_jump()
 
     @instruction("JIZERO", OpType.LABEL, False)
     def _jizero(self: Self):
         '''Jumps to the INSTRUCTION at LABEL if the ACCUMULATOR is ZERO'''
-        if self._accumulator == 0:
-            self._instruction_ptr = self._labels[self._current_line.operand]
-            self._branch = True
+        if self._accumulator == 0: self._loop_jump()
 
     @instruction("JINEG", OpType.LABEL, False)
     def _jineg(self: Self):
         '''Jumps to the INSTRUCTION at LABEL if the ACCUMULATOR is NEGATIVE'''
-        if self._accumulator < 0:
-            self._instruction_ptr = self._labels[self._current_line.operand]
-            self._branch = True
+        if self._accumulator < 0: self._loop_jump()
+
+    def _loop_jump(self: Self):
+        '''Jumps to LABEL, running the rest of the loop this jump closes in
+        its compiled kernel, if there is (or, now it is hot, can be) one'''
+        if self._detect_loops:
+            head = self._labels[self._current_line.operand]
+            if head <= self._instruction_ptr: self._check_loop_state(head)
+
+        kernel = self._loop_kernels.get(self._instruction_ptr)
+        if kernel is None and self._trace_counts is not None:
+            kernel = self._count_back_edge()
+        if kernel is not None:
+            kernel, mnemonics, trace = kernel
+            limit = (self._step_limit - self._steps) // len(mnemonics)
+            if self._detect_loops: limit = min(limit, LOOP_CHECK_ITERATIONS)
+            self._accumulator, looping, iterations = kernel(
+                self._accumulator, self._variables, limit, self._write)
+            self._steps += iterations * len(mnemonics)
+            if self._stats is not None:
+                for mnemonic in mnemonics:
+                    self._stats.mnemonic_counts[mnemonic] += iterations
+            for callback in self._trace_hooks:
+                callback(self, trace, iterations, not looping)
+            if not looping:
+                # Loop is complete; continue after the jump
+                self._instruction_ptr += 1
+                self._branch = True
+                return
+
+        self._instruction_ptr = self._labels[self._current_line.operand]
+        self._branch = True
 
     # CESIL Plus Instructions
 
@@ -544,57 +2181,176 @@ class CESIL():
     @instruction("RETURN", OpType.NONE, True)
     def _return_cesil(self: Self):
         '''Returns from SUBROUTINE to INSTRUCTION after JUMPSR/JSIZERO/JSINEG'''
+        if len(self._call_stack) == 0:
+            raise CESILException(self._current_line.line_number,
+                                 'RETURN without SUBROUTINE call', 'RETURN')
+        if self._memo_pending: self._memo_store(len(self._call_stack))
         self._instruction_ptr = self._call_stack.pop()
 
     @instruction("JUMPSR", OpType.LABEL, True)
     def _jumpsr(self: Self):
         '''Jumps to the SUBROUTINE at LABEL'''
-        self._call_stack.append(self._instruction_ptr)
-        self._instruction_ptr = self._labels[self._current_line.operand]
-        self._branch = True
+        self._call_subroutine()
 
     @instruction("JSIZERO", OpType.LABEL, True)
     def _jsizero(self: Self):
         '''Jumps to the SUBROUTINE at LABEL if the ACCUMULATOR is ZERO'''
-        if self._accumulator == 0:
-            self._call_stack.append(self._instruction_ptr)
-            self._instruction_ptr = self._labels[self._current_line.operand]
-            self._branch = True
+        if self._accumulator == 0: self._call_subroutine()
 
     @instruction("JSINEG", OpType.LABEL, True)
     def _jsineg(self: Self):
         '''Jumps to the SUBROUTINE at LABEL if the ACCUMULATOR is NEGATIVE'''
-        if self._accumulator < 0:
-            self._call_stack.append(self._instruction_ptr)
-            self._instruction_ptr = self._labels[self._current_line.operand]
-            self._branch = True
+        if self._accumulator < 0: self._call_subroutine()
+
+    def _call_subroutine(self: Self):
+        '''Saves the return point and jumps to the SUBROUTINE at LABEL'''
+        if len(self._call_stack) >= self._max_calls:
+            raise CallQuotaExceeded(self._current_line.line_number,
+                                    len(self._call_stack))
+        entry = self._labels[self._current_line.operand]
+        if entry in self._pure_subroutines and self._memo_call(entry): return
+
+        self._call_stack.append(self._instruction_ptr)
+        self._instruction_ptr = entry
+        self._branch = True
+
+    def _memo_call(self: Self, entry: int) -> bool:
+        '''Applies a cached result for the pure SUBROUTINE at "entry", if
+        there is one; otherwise arranges for RETURN to cache it'''
+        inputs, outputs = self._pure_subroutines[entry]
+        key = (entry, self._accumulator,
+               *[self._variables.get(name) for name in inputs])
+        result = self._memo_cache.get(key)
+        # A call that would pass the step limit runs, to stop where it
+        # would; as does one cached before statistics were collected.
+        if (result is not None and
+                self._steps + result[1] <= self._step_limit and
+                (self._stats is None or result[2] is not None)):
+            self.memo_hits += 1
+            self._memo_cache.move_to_end(key)
+            accumulator, steps, counts, values = result
+            self._accumulator = accumulator
+            self._steps += steps
+            for name, value in zip(outputs, values):
+                if value is not None: self._variables[name] = value
+            if counts is not None:
+                mnemonic_counts = self._stats.mnemonic_counts
+                for mnemonic, count in counts.items():
+                    mnemonic_counts[mnemonic] += count
+            return True
+
+        # Cache on RETURN from this call's frame, if the STACK below the
+        # entry depth has not been touched (low water) and is back there.
+        self.memo_misses += 1
+        counts = None
+        if self._stats is not None:
+            # Instructions are counted as they complete; so this call is
+            # not counted yet, but must not be in the cached counts.
+            counts = dict(self._stats.mnemonic_counts)
+            counts[self._current_line.instruction] += 1
+        self._memo_pending[len(self._call_stack) + 1] = (
+            key, outputs, len(self._stack), self._memo_low_water,
+            self._steps, counts)
+        self._memo_low_water = len(self._stack)
+        return False
+
+    def _memo_store(self: Self, depth: int):
+        '''Caches the result of a pure SUBROUTINE returning from "depth"'''
+        pending = self._memo_pending.pop(depth, None)
+        if pending is None: return
+
+        key, outputs, stack_depth, outer_low_water, steps, counts = pending
+        if (self._memo_low_water >= stack_depth and
+                len(self._stack) == stack_depth):
+            # Hits replay the steps, and instructions counted, after the
+            # call, up to and including this RETURN.
+            if counts is not None:
+                counts = {mnemonic: count - counts[mnemonic]
+                          for mnemonic, count
+                          in self._stats.mnemonic_counts.items()
+                          if count != counts[mnemonic]}
+                counts['RETURN'] = counts.get('RETURN', 0) + 1
+            self._memo_cache[key] = (
+                self._accumulator, self._steps - steps, counts,
+                tuple(self._variables.get(name) for name in outputs))
+            if len(self._memo_cache) > self._memo_size:
+                self._memo_cache.popitem(last=False)
+        self._memo_low_water = min(self._memo_low_water, outer_low_water)
 
     @instruction("POP", OpType.NONE, True)
     def _pop(self: Self):
         '''Pops the top value off the STACK and into the ACCUMULATOR'''
+        if len(self._stack) == 0:
+            raise CESILException(self._current_line.line_number,
+                                 'Stack underflow; STACK is empty', 'POP')
         self._accumulator = self._stack.pop()
+        if len(self._stack) < self._memo_low_water:
+            self._memo_low_water = len(self._stack)
 
     @instruction("PUSH", OpType.NONE, True)
     def _push(self: Self):
         '''Pushes the ACCUMULATOR value onto the top of the STACK'''
+        if len(self._stack) >= self._max_stack:
+            raise StackQuotaExceeded(self._current_line.line_number,
+                                     len(self._stack))
         self._stack.append(self._accumulator)
 
     @instruction("RANDOM", OpType.LITERAL_VAR, True)
     def _random(self: Self):
         '''Sets the ACCUMULATOR to a RANDOM number from 0 to OPERAND'''
-        self._accumulator = randint(0,
-            self._get_real_value(self._current_line.operand))
+        upper = self._get_real_value(self._current_line.operand)
+        if upper < 0:
+            raise CESILException(self._current_line.line_number,
+                                 'Illegal RANDOM range', upper)
+        self._accumulator = self._rng.next_value(upper)
     
     @instruction("OUTCHAR", OpType.NONE, True)
     def _outchar(self: Self):
         '''Prints the ASCII character for the VALUE of the ACCUMULATOR'''        
         new_line = '\n' if self._debug_level > 0 else ''
-        print(chr(self._accumulator), end=new_line)
+        self._write(chr(self._accumulator) + new_line)
 
     @instruction("INPUTN", OpType.NONE, True)
     def _inputn(self: Self):
         '''Takes CONSOLE input of an INTEGER and stores it in the ACCUMULATOR'''
-        self._accumulator = int(input())
+        value = next(self._input_values, None)
+        if value is None:
+            raise CESILException(self._current_line.line_number,
+                                 'No INPUTN value available', 'INPUTN')
+        try:
+            self._accumulator = int(value)
+        except ValueError:
+            raise CESILException(self._current_line.line_number,
+                                 'Illegal INPUTN value', value)
+        if self._input_record is not None:
+            self._input_record.write('{0}\n'.format(self._accumulator))
+
+    @instruction("MLOAD", OpType.LITERAL_VAR, True)
+    def _mload(self: Self):
+        '''Loads the MEMORY word at address OPERAND into the ACCUMULATOR'''
+        self._accumulator = self._memory[self._memory_address(
+            self._get_real_value(self._current_line.operand))]
+
+    @instruction("MLOADA", OpType.NONE, True)
+    def _mloada(self: Self):
+        '''Loads the MEMORY word at the address in the ACCUMULATOR into the
+        ACCUMULATOR'''
+        self._accumulator = self._memory[self._memory_address(
+            self._accumulator)]
+
+    @instruction("MSTORE", OpType.LITERAL_VAR, True)
+    def _mstore(self: Self):
+        '''Stores the ACCUMULATOR (as an INTEGER) in MEMORY at address
+        OPERAND'''
+        self._memory[self._memory_address(self._get_real_value(
+            self._current_line.operand))] = int(self._accumulator)
+
+    def _memory_address(self: Self, address: int) -> int:
+        '''Checks "address" is within MEMORY, raising CESILException if not'''
+        if type(address) is not int or not 0 <= address < len(self._memory):
+            raise CESILException(self._current_line.line_number,
+                                 'MEMORY address out of range', address)
+        return address
 
     @instruction("INC", OpType.NONE, True)
     def _inc(self: Self):
@@ -606,13 +2362,550 @@ class CESIL():
         '''Decrements the ACCUMULATOR by 1'''
         self._accumulator -= 1
 
+# Editor Integration
+
+@dataclass(slots=True, eq=False)
+class DocumentLine:
+    '''A CESILDocument code line's parse result, or the error parsing it,
+    and its current position'''
+    parsed: CodeLine | None
+    error: CESILException | None = None
+    line_number: int = 0
+    instruction_index: int = 0
+
+
+class CESILDocument():
+    '''Incrementally parsed CESIL source, for editor/language-server use.
+
+    Edits re-parse only the lines they replace, and update the label,
+    variable and error tables for only those lines.  Line numbers and
+    instruction indexes, from the first edited line on, are renumbered the
+    next time they are queried.  Edits use 0-based, Python slice style, line
+    indexes; results report 1-based line numbers, as CESILException does.'''
+
+    def __init__(self: Self, interpreter: CESIL, source: str = '',
+                 source_format: str = 'text'):
+        '''Initialize a new document, parsed by "interpreter".'''
+        self._interpreter = interpreter
+        interpreter.set_source_format(source_format, source.splitlines())
+
+        # Source lines, and a DocumentLine for each code line (None for
+        # blank and comment lines, and the Data Section, which starts at
+        # line index "data_start").
+        self._lines = []
+        self._records = []
+        self._data_start = 0
+
+        # Tables of the code lines that define or use each name, and those
+        # with errors; updated line by line as edits are made.
+        self._label_defs = {}
+        self._label_refs = {}
+        self._variable_uses = {}
+        self._errors = set()
+
+        # Positions are valid before line index "renumber_from" (or all
+        # of them, if None)
+        self._renumber_from = None
+        self._instruction_lines = []
+
+        self.set_text(source)
+
+    def set_text(self: Self, source: str):
+        '''Replaces the entire document text'''
+        self.edit(0, len(self._lines), source.splitlines())
+
+    def edit(self: Self, start: int, end: int, lines: list[str]):
+        '''Replaces source lines[start:end] with "lines"'''
+        start, end, _ = slice(start, end).indices(len(self._lines))
+        end = max(start, end)
+        for record in self._records[start:end]: self._withdraw(record)
+        self._lines[start:end] = lines
+        self._records[start:end] = [None] * len(lines)
+        added_end = start + len(lines)
+        data_start = self._data_start
+
+        if data_start < start:
+            # Only the Data Section changed
+            return
+        new_start = next((index for index in range(start, added_end)
+                          if self._is_data_start(index)), None)
+        if new_start is not None:
+            # Code between the new Data Section start and the old one is
+            # now data.
+            old_start = data_start + added_end - end
+            for index in range(added_end, max(added_end, old_start)):
+                self._withdraw(self._records[index])
+                self._records[index] = None
+            self._data_start = new_start
+        elif data_start >= end:
+            self._data_start = data_start + added_end - end
+        else:
+            # The Data Section start was replaced; data up to the next one
+            # (if any) is now code.
+            self._data_start = next(
+                (index for index in range(added_end, len(self._lines))
+                 if self._is_data_start(index)), len(self._lines))
+            added_end = self._data_start
+
+        for index in range(start, min(added_end, self._data_start)):
+            self._records[index] = self._parse_line(index)
+            if self._records[index] is not None:
+                self._contribute(self._records[index])
+        if self._renumber_from is None or start < self._renumber_from:
+            self._renumber_from = start
+
+    @property
+    def labels(self: Self) -> dict[str, int]:
+        '''LABELs and the instruction index each one refers to'''
+        self._renumber()
+        return {label: max(records, key=self._position).instruction_index
+                for label, records in self._label_defs.items()}
+
+    @property
+    def variables(self: Self) -> dict[str, int]:
+        '''VARIABLEs and the line number each is first used on'''
+        self._renumber()
+        return {name: min(record.line_number for record in records)
+                for name, records in self._variable_uses.items()}
+
+    @property
+    def instruction_lines(self: Self) -> list[int]:
+        '''Line numbers of each instruction, by instruction index'''
+        self._renumber()
+        return list(self._instruction_lines)
+
+    def diagnostics(self: Self) -> list[CESILException]:
+        '''Syntax and LABEL errors in the current document text'''
+        self._renumber()
+        diagnostics = [record.error for record in self._errors]
+        for label, records in self._label_defs.items():
+            diagnostics.extend(
+                CESILException(record.line_number, 'Duplicate label', label)
+                for record in sorted(records, key=self._position)[1:])
+        for label, records in self._label_refs.items():
+            if label not in self._label_defs:
+                diagnostics.extend(
+                    CESILException(record.line_number, 'Undefined label',
+                                   label) for record in records)
+        diagnostics.sort(key=lambda err: err.line_number)
+        return diagnostics
+
+    def definition(self: Self, label: str) -> int | None:
+        '''Line number "label" is defined on, None if undefined'''
+        self._renumber()
+        records = self._label_defs.get(label)
+        if records is None: return None
+        return max(record.line_number for record in records)
+
+    def references(self: Self, label: str) -> list[int]:
+        '''Line numbers of instructions that use "label" as an operand'''
+        self._renumber()
+        return sorted(record.line_number
+                      for record in self._label_refs.get(label, ()))
+
+    @staticmethod
+    def _position(record: DocumentLine) -> int:
+        return record.line_number
+
+    def _is_data_start(self: Self, index: int) -> bool:
+        '''True if the line at "index" starts the Data Section'''
+        interpreter = self._interpreter
+        line = self._lines[index]
+        return not (interpreter._is_blank(line) or
+                    interpreter._is_comment(line)) and (
+                        interpreter._is_data_start(line))
+
+    def _parse_line(self: Self, index: int) -> DocumentLine | None:
+        '''Parses a line of code; None for blank and comment lines'''
+        interpreter = self._interpreter
+        line = self._lines[index] + '\n'
+        if interpreter._is_blank(line) or interpreter._is_comment(line):
+            return None
+
+        try:
+            parsed = interpreter._parse_code_line(line, index + 1)
+        except CESILException as err:
+            return DocumentLine(None, err)
+        if (parsed.instruction is None and
+                len(interpreter._get_line_parts(line, index + 1)) >
+                (0 if parsed.label is None else 1)):
+            return DocumentLine(None, CESILException(
+                index + 1, 'Unknown instruction', line.strip()))
+
+        error = None
+        if (parsed.instruction is not None and parsed.operand is None and
+                interpreter._instructions[parsed.instruction][
+                    OPERAND_TYPE] == OpType.LABEL):
+            error = CESILException(index + 1, 'Illegal label', line.strip())
+        return DocumentLine(parsed, error)
+
+    def _table_entries(self: Self, record: DocumentLine) -> Iterator[tuple]:
+        '''The tables "record" is in, and the name it is under in each'''
+        parsed = record.parsed
+        if parsed is None: return
+        if parsed.label is not None: yield self._label_defs, parsed.label
+        if parsed.instruction is None or parsed.operand is None: return
+
+        op_type = self._interpreter._instructions[parsed.instruction][
+            OPERAND_TYPE]
+        if op_type == OpType.LABEL:
+            yield self._label_refs, parsed.operand
+        elif (op_type in (OpType.LITERAL_VAR, OpType.VAR) and
+                self._interpreter._is_legal_identifier(parsed.operand)):
+            yield self._variable_uses, parsed.operand
+
+    def _contribute(self: Self, record: DocumentLine):
+        '''Adds a newly parsed code line to the tables'''
+        if record.error is not None: self._errors.add(record)
+        for table, name in self._table_entries(record):
+            table.setdefault(name, set()).add(record)
+
+    def _withdraw(self: Self, record: DocumentLine | None):
+        '''Removes a code line that has been edited away from the tables'''
+        if record is None: return
+        self._errors.discard(record)
+        for table, name in self._table_entries(record):
+            records = table[name]
+            records.discard(record)
+            if not records: del table[name]
+
+    def _renumber(self: Self):
+        '''Brings the positions of lines after the first edit up to date'''
+        start = self._renumber_from
+        if start is None: return
+
+        instruction_lines = self._instruction_lines
+        del instruction_lines[bisect_left(instruction_lines, start + 1):]
+        for index in range(start, self._data_start):
+            record = self._records[index]
+            if record is None: continue
+            record.line_number = index + 1
+            record.instruction_index = len(instruction_lines)
+            if record.error is not None: record.error.line_number = index + 1
+            if record.parsed is not None and (
+                    record.parsed.instruction is not None):
+                instruction_lines.append(index + 1)
+        self._renumber_from = None
+
+
+# Coverage
+
+class CESILCoverage(CESILHooks):
+    '''Records executed instructions, and the taken/not-taken outcomes of
+    conditional jumps, for a loaded program.  Coverage from many runs, data
+    sets or processes (via save/load) of the same program can be merged.
+
+    Coverage is of the program as written, however it is run: compiled
+    loop kernels report the loops they run (see on_trace()), coalesced
+    output covers the lines it replaces, and the RETURN after a tail call
+    is covered when the SUBROUTINE the tail call jumped to returns.'''
+
+    def __init__(self: Self, cesil: CESIL):
+        '''Initialize empty coverage for the program "cesil" has loaded'''
+        program = cesil.program
+        self.program_hash = self.hash_program(program.lines, program.labels)
+        self._program_lines = program.lines
+        size = len(program.lines)
+        # One flag byte per instruction while recording; bits when saved.
+        self.executed = bytearray(size)
+        self.taken = bytearray(size)
+        self.not_taken = bytearray(size)
+
+        # The index, in the program as written, of each line run (a LOAD
+        # after a coalesced PRINT has that PRINT's), and the RETURNs after
+        # tail calls made in each SUBROUTINE call still to return
+        self._origins = []
+        index = 0
+        load_after = False
+        for line in cesil.program_lines:
+            if load_after:
+                self._origins.append(self._origins[-1])
+                load_after = False
+                continue
+            self._origins.append(index)
+            if type(line) is CoalescedLine:
+                index += len(line.folded)
+                load_after = len(line.counted) < len(line.folded)
+            else:
+                index += 1
+        self._tail_returns = [set()]
+
+    @staticmethod
+    def hash_program(program_lines: Sequence[CodeLine],
+                     labels: Mapping[str, int]) -> str:
+        '''Identifies a program, so only coverage for it is merged; LABELs
+        are included, as those on lines of their own are in no CodeLine'''
+        digest = hashlib.sha256()
+        for line in program_lines:
+            digest.update(repr((line.label, line.instruction, line.operand,
+                                line.line_number)).encode())
+        digest.update(repr(sorted(labels.items())).encode())
+        return digest.hexdigest()
+
+    def on_step(self: Self, cesil: CESIL, index: int, line: CodeLine):
+        index = self._origins[index]
+        self.executed[index] = 1
+        if type(line) is CoalescedLine:
+            self.executed[index:index + len(line.folded)] = (
+                b'\1' * len(line.folded))
+
+    def on_branch(self: Self, cesil: CESIL, index: int, line: CodeLine,
+                  taken: bool):
+        index = self._origins[index]
+        instruction = self._program_lines[index].instruction
+        if instruction in CONDITIONAL_JUMPS:
+            if taken:
+                self.taken[index] = 1
+            else:
+                self.not_taken[index] = 1
+        if taken and instruction != line.instruction:
+            # A tail call; its RETURN runs when the SUBROUTINE returns
+            self._tail_returns[-1].add(index + 1)
+
+    def on_call(self: Self, cesil: CESIL, index: int, target: int):
+        self._tail_returns.append(set())
+
+    def on_return(self: Self, cesil: CESIL, index: int, return_index: int):
+        for tail_return in self._tail_returns.pop():
+            self.executed[tail_return] = 1
+
+    def on_trace(self: Self, cesil: CESIL, trace: list[tuple[int, bool]],
+                 iterations: int, ended: bool):
+        if iterations == 0: return
+        program_lines = cesil.program_lines
+        for index, taken in trace[:-1]:
+            self.on_step(cesil, index, program_lines[index])
+            if program_lines[index].instruction in TRACE_JUMPS:
+                self.on_branch(cesil, index, program_lines[index], taken)
+        # Each iteration but (if the loop ended) the last jumped back
+        index = trace[-1][0]
+        self.on_step(cesil, index, program_lines[index])
+        if not ended or iterations > 1:
+            self.on_branch(cesil, index, program_lines[index], True)
+        if ended:
+            self.on_branch(cesil, index, program_lines[index], False)
+
+    def merge(self: Self, other: 'CESILCoverage'):
+        '''Adds the coverage recorded by "other" to this coverage'''
+        if other.program_hash != self.program_hash:
+            raise ValueError('Coverage is for a different program')
+        for mine, theirs in ((self.executed, other.executed),
+                             (self.taken, other.taken),
+                             (self.not_taken, other.not_taken)):
+            for index, flag in enumerate(theirs):
+                if flag: mine[index] = 1
+
+    def to_dict(self: Self) -> dict:
+        '''Machine-readable coverage; flags are packed as hex bitsets'''
+        return {
+            'program': self.program_hash,
+            'instructions': len(self.executed),
+            'executed': self._pack(self.executed),
+            'taken': self._pack(self.taken),
+            'not_taken': self._pack(self.not_taken),
+            'summary': self.summary()}
+
+    def save(self: Self, filename: str):
+        '''Saves coverage, merging with any already saved for the program.
+        Processes saving to one file take turns (where files can be locked),
+        and it is replaced whole, so is never seen part written.'''
+        with open(filename + LOCK_SUFFIX, 'a') as lock:
+            if fcntl is not None: fcntl.flock(lock, fcntl.LOCK_EX)
+            if os.path.exists(filename): self.load(filename)
+            partial = '{0}.{1}'.format(filename, os.getpid())
+            with open(partial, 'w') as writer:
+                json.dump(self.to_dict(), writer, indent=2)
+            os.replace(partial, filename)
+
+    def load(self: Self, filename: str):
+        '''Merges coverage previously saved to "filename"'''
+        with open(filename, 'r') as reader:
+            saved = json.load(reader)
+        if saved['program'] != self.program_hash:
+            raise ValueError('Coverage is for a different program')
+
+        size = len(self.executed)
+        for mine, packed in ((self.executed, saved['executed']),
+                             (self.taken, saved['taken']),
+                             (self.not_taken, saved['not_taken'])):
+            for index, flag in enumerate(self._unpack(packed, size)):
+                if flag: mine[index] = 1
+
+    def summary(self: Self) -> dict:
+        '''Counts of instructions and branch outcomes, and those covered'''
+        branches = [index for index, line in enumerate(self._program_lines)
+                    if line.instruction in CONDITIONAL_JUMPS]
+        return {
+            'instructions': len(self.executed),
+            'instructions_executed': sum(self.executed),
+            'branch_outcomes': len(branches) * 2,
+            'branch_outcomes_covered':
+                sum(self.taken[index] + self.not_taken[index]
+                    for index in branches)}
+
+    def listing(self: Self, source_lines: list[str]) -> Iterator[str]:
+        '''Annotates the program source with coverage; executed lines are
+        marked "+", never executed "-", and conditional jumps show T (taken)
+        and F (not taken) for each outcome seen'''
+        by_line = {line.line_number: index
+                   for index, line in enumerate(self._program_lines)}
+        for line_number, text in enumerate(source_lines, 1):
+            mark = branch = ''
+            index = by_line.get(line_number)
+            if index is not None:
+                mark = '+' if self.executed[index] else '-'
+                if (self._program_lines[index].instruction in
+                        CONDITIONAL_JUMPS):
+                    branch = '[{0}{1}]'.format(
+                        'T' if self.taken[index] else '-',
+                        'F' if self.not_taken[index] else '-')
+            yield '{0:>5} {1:1} {2:<4} {3}'.format(
+                line_number, mark, branch, text.rstrip('\n'))
+
+        summary = self.summary()
+        yield 'Instructions: {0}/{1}  Branch outcomes: {2}/{3}'.format(
+            summary['instructions_executed'], summary['instructions'],
+            summary['branch_outcomes_covered'], summary['branch_outcomes'])
+
+    @staticmethod
+    def _pack(flags: bytearray) -> str:
+        '''Packs one-byte flags into a hex bitset (bit n = flag n)'''
+        bits = bytearray((len(flags) + 7) // 8)
+        for index, flag in enumerate(flags):
+            if flag: bits[index >> 3] |= 1 << (index & 7)
+        return bits.hex()
+
+    @staticmethod
+    def _unpack(packed: str, size: int) -> bytearray:
+        '''Unpacks a hex bitset into one-byte flags'''
+        bits = bytes.fromhex(packed)
+        return bytearray((bits[index >> 3] >> (index & 7)) & 1
+                         for index in range(size))
+
+
+
+class CESILProfile(CESILHooks):
+    '''Records how often each instruction runs, and which way each jump
+    goes, so later runs of the program can compile its hot loops up front
+    (see CESIL.apply_profile()).  Profiles of many runs can be merged.'''
+
+    def __init__(self: Self, cesil: CESIL):
+        '''Initialize an empty profile for the program "cesil" has loaded'''
+        self.program_hash = CESILCoverage.hash_program(cesil.program_lines,
+                                                       cesil.labels)
+        size = len(cesil.program_lines)
+        self.executed = [0] * size
+        self.taken = [0] * size
+        self.not_taken = [0] * size
+
+    def on_step(self: Self, cesil: CESIL, index: int, line: CodeLine):
+        self.executed[index] += 1
+
+    def on_branch(self: Self, cesil: CESIL, index: int, line: CodeLine,
+                  taken: bool):
+        if taken:
+            self.taken[index] += 1
+        else:
+            self.not_taken[index] += 1
+
+    def merge(self: Self, other: 'CESILProfile'):
+        '''Adds the counts recorded by "other" to this profile'''
+        if other.program_hash != self.program_hash:
+            raise ValueError('Profile is for a different program')
+        for mine, theirs in ((self.executed, other.executed),
+                             (self.taken, other.taken),
+                             (self.not_taken, other.not_taken)):
+            for index, count in enumerate(theirs):
+                mine[index] += count
+
+    def to_dict(self: Self) -> dict:
+        '''Machine-readable profile'''
+        return {
+            'program': self.program_hash,
+            'executed': self.executed,
+            'taken': self.taken,
+            'not_taken': self.not_taken}
+
+    def save(self: Self, filename: str):
+        '''Saves the profile, replacing any saved for another program'''
+        with open(filename, 'w') as writer:
+            json.dump(self.to_dict(), writer)
+
+    def load(self: Self, filename: str):
+        '''Merges the profile previously saved to "filename"'''
+        with open(filename, 'r') as reader:
+            saved = json.load(reader)
+        if saved['program'] != self.program_hash:
+            raise ValueError('Profile is for a different program')
+
+        for mine, counts in ((self.executed, saved['executed']),
+                             (self.taken, saved['taken']),
+                             (self.not_taken, saved['not_taken'])):
+            for index, count in enumerate(counts):
+                mine[index] += count
+
+
+class CESILResultCache():
+    '''On-disk cache of the output and final status of whole runs, one
+    JSON file per run in "directory", shared by any number of processes.
+    The least recently used are removed beyond "max_entries" (see
+    CESIL.run_cached()).'''
+
+    def __init__(self: Self, directory: str,
+                 max_entries: int = DEFAULT_CACHE_ENTRIES):
+        os.makedirs(directory, exist_ok=True)
+        self._directory = directory
+        self._max_entries = max_entries
+
+    def get(self: Self, key: str) -> dict | None:
+        '''The result saved for "key", marking it recently used; None if
+        there isn't one'''
+        filename = os.path.join(self._directory, key + CACHE_SUFFIX)
+        try:
+            with open(filename, 'r') as reader:
+                result = json.load(reader)
+            os.utime(filename)
+        except (OSError, ValueError):
+            return None
+        return result
+
+    def put(self: Self, key: str, result: dict):
+        '''Saves "result" for "key", removing the least recently used
+        results if there are now too many'''
+        filename = os.path.join(self._directory, key + CACHE_SUFFIX)
+        # Written whole then renamed, so other processes (and threads)
+        # never see a part
+        partial = '{0}.{1}.{2}'.format(filename, os.getpid(),
+                                       threading.get_ident())
+        with open(partial, 'w') as writer:
+            json.dump(result, writer)
+        os.replace(partial, filename)
+
+        # Other processes may be removing the same entries
+        entries = []
+        for entry in os.scandir(self._directory):
+            if not entry.name.endswith(CACHE_SUFFIX): continue
+            try:
+                entries.append((entry.stat().st_mtime, entry.path))
+            except OSError:
+                pass
+        if len(entries) > self._max_entries:
+            entries.sort()
+            for _, path in entries[:len(entries) - self._max_entries]:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+
 # Command Line Interface
 
 @click.command()
 @click.option('-s', '--source',
-              type=click.Choice(['t', 'text', 'c', 'card'],
+              type=click.Choice(['a', 'auto', 't', 'text', 'c', 'card'],
                                 case_sensitive=False),
-              default='text', show_default=True, help='Text or Card input.')
+              default='text', show_default=True,
+              help='Text or Card input, or auto-detect which.')
 @click.option('-d', '--debug',
               type=click.Choice(['0', '1', '2', '3', '4'],
                                 case_sensitive=False),
@@ -620,9 +2913,56 @@ class CESIL():
               help='Debug mode/verbosity level.')
 @click.option('-p', '--plus', is_flag=True, default=False,
               help='Enables "plus" mode language extensions.')
-@click.version_option('0.9.3')
+@click.option('--max-stack', type=click.IntRange(min=0),
+              default=DEFAULT_MAX_STACK, show_default=True,
+              help='Maximum number of items on the STACK.')
+@click.option('--max-calls', type=click.IntRange(min=0),
+              default=DEFAULT_MAX_CALLS, show_default=True,
+              help='Maximum depth of nested SUBROUTINE calls.')
+@click.option('--max-variables', type=click.IntRange(min=0),
+              help='Maximum number of distinct VARIABLES.')
+@click.option('--max-output', type=click.IntRange(min=0),
+              help='Maximum number of bytes output.')
+@click.option('--memory', type=click.IntRange(min=0),
+              default=DEFAULT_MEMORY_SIZE, show_default=True,
+              help='Words of indexed MEMORY (MLOAD, MLOADA, MSTORE).')
+@click.option('-m', '--memoize', is_flag=True, default=False,
+              help='Caches results of pure SUBROUTINEs (no I/O or RANDOM).')
+@click.option('--optimize/--no-optimize', default=True, show_default=True,
+              help='Tail-call elimination and compiled hot loops.')
+@click.option('--detect-loops', is_flag=True, default=False,
+              help='Stops with an error if the program state repeats.')
+@click.option('--max-steps', type=click.IntRange(min=0),
+              help='Stops with an error after this many instructions.')
+@click.option('--seed', type=int,
+              help='Seeds RANDOM, for reproducible runs.')
+@click.option('--input', 'input_file', type=click.File('r'),
+              help='Reads INPUTN values from this file (- for stdin).')
+@click.option('--record', type=click.File('w'),
+              help='Records INPUTN values to this file, for replay.')
+@click.option('--coverage', type=click.Path(dir_okay=False),
+              help='Merges line/branch coverage into this JSON file.')
+@click.option('--coverage-listing', is_flag=True, default=False,
+              help='Prints the source annotated with coverage to stderr.')
+@click.option('--stats', is_flag=True, default=False,
+              help='Prints load and run statistics, as JSON, to stderr.')
+@click.option('--profile', is_flag=True, default=False,
+              help='Compiles hot loops using the run profile saved next to '
+                   'SOURCE_FILE, recording one first if there is none.')
+@click.option('--cache', type=click.Path(file_okay=False),
+              help='Reuses results of identical runs saved in this folder.')
+@click.option('--ext', multiple=True,
+              help='Adds the instructions of this extension plugin (module, '
+                   '.py file or entry point); repeatable.')
+@click.version_option(VERSION)
 @click.argument('source_file', type=click.Path(exists=True))
-def cesilplus(source: str, debug: int, plus: bool, source_file: str):
+def cesilplus(source: str, debug: int, plus: bool, max_stack: int,
+              max_calls: int, max_variables: int, max_output: int,
+              memory: int, memoize: bool, optimize: bool, detect_loops: bool,
+              max_steps: int, seed: int,
+              input_file: TextIO, record: TextIO, coverage: str,
+              coverage_listing: bool, stats: bool, profile: bool, cache: str,
+              ext: tuple[str], source_file: str):
     """CESILPlus - CESIL Interpreter (w/ optional language extentions).
     
     \b
@@ -643,6 +2983,12 @@ def cesilplus(source: str, debug: int, plus: bool, source_file: str):
     \b
         PUSH            - PUSHes the ACCUMULATOR value on to STACK
         POP             - POPs top value from STACK into the ACCUMULATOR
+    \b
+        MLOAD   operand - Loads the MEMORY word at address operand into the
+                          ACCUMULATOR
+        MLOADA          - Loads the MEMORY word at the address in the
+                          ACCUMULATOR into the ACCUMULATOR
+        MSTORE  operand - Stores the ACCUMULATOR in MEMORY at address operand
     \b
         INC             - Increments the ACCUMULATOR by 1
         DEC             - Decrements the ACCUMULATOR by 1
@@ -658,14 +3004,63 @@ def cesilplus(source: str, debug: int, plus: bool, source_file: str):
         RETURN          - Returns from SUBROUTINE and continues execution
     """
 
+    cesil_coverage = None
+    cesil_profile = None
+    cesil_stats = None
+    profile_file = source_file + PROFILE_SUFFIX
     try:
-        cesil_interpreter = CESIL(plus, int(debug))
+        is_covered = coverage is not None or coverage_listing
+        cesil_interpreter = CESIL(plus, int(debug), max_stack, max_calls,
+                                  memoize, optimize, seed,
+                                  max_variables, max_output, detect_loops,
+                                  memory)
+        if stats:
+            cesil_interpreter.collect_stats()
+            cesil_stats = cesil_interpreter.stats
+        for name in ext:
+            try:
+                cesil_interpreter.load_extension(name)
+            except (ImportError, ValueError) as err:
+                raise click.BadParameter(str(err), param_hint='--ext')
         cesil_interpreter.load(source_file, source)
-        cesil_interpreter.run()
+        if input_file is not None: cesil_interpreter.set_input(input_file)
+        cesil_interpreter.record_input(record)
+        if is_covered:
+            cesil_coverage = CESILCoverage(cesil_interpreter)
+            cesil_interpreter.add_hooks(cesil_coverage)
+        if profile:
+            cesil_profile = CESILProfile(cesil_interpreter)
+            try:
+                cesil_profile.load(profile_file)
+                cesil_interpreter.apply_profile(cesil_profile)
+                cesil_profile = None
+            except (OSError, ValueError):
+                # No profile for this version of the program yet; record one
+                cesil_interpreter.add_hooks(cesil_profile)
+        if cache is not None:
+            cesil_interpreter.run_cached(CESILResultCache(cache), max_steps)
+        else:
+            cesil_interpreter.run(max_steps)
+        if memoize and not stats:
+            click.echo('Memoized SUBROUTINEs: {0} hits, {1} misses'.format(
+                cesil_interpreter.memo_hits, cesil_interpreter.memo_misses),
+                err=True)
     except CESILException as err:
         err.print()
+    finally:
+        if cesil_stats is not None: click.echo(cesil_stats.to_json(), err=True)
+        if cesil_profile is not None: cesil_profile.save(profile_file)
+        # Coverage of runs ending in an error is still recorded
+        if cesil_coverage is not None:
+            if coverage is not None: cesil_coverage.save(coverage)
+            if coverage_listing:
+                with open(source_file, 'r') as reader:
+                    for line in cesil_coverage.listing(reader.readlines()):
+                        click.echo(line, err=True)
 
 
 # Run!
 if __name__ == '__main__':
+    # Extension plugins import CESIL; they must get this module, not a copy
+    sys.modules.setdefault('CESIL', sys.modules[__name__])
     cesilplus()
@@ -0,0 +1,92 @@
+# CESIL Bench - Parsing/Loading benchmarks for the CESIL Plus Interpreter
+#
+# Copyright (C) 2020-2023, Ian Michael Dunmore
+#
+# License: https://github.com/idunmore/CESIL/blob/master/LICENSE
+
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+import click
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+from CESIL import CESIL
+from CESILGen import generate_lines
+
+# Constants
+
+# Program sizes (in lines) benchmarked by default
+DEFAULT_SIZES = '1000,10000,100000,1000000'
+
+# A per-line figure growing by more than this, from the smallest to the
+# largest size, suggests superlinear load() behaviour
+SUPERLINEAR_RATIO = 2.0
+
+# Functions
+
+def time_load(filename: str, source_format: str) -> float:
+    '''Returns the time, in seconds, taken to load() "filename"'''
+    interpreter = CESIL(False, 0)
+    start = time.perf_counter()
+    interpreter.load(filename, source_format)
+    return time.perf_counter() - start
+
+
+def load_memory(filename: str, source_format: str) -> tuple[float, int]:
+    '''Returns the memory, in bytes per instruction, a load()ed "filename"
+    keeps allocated, and the peak memory, in bytes, load() used'''
+    tracemalloc.start()
+    interpreter = CESIL(False, 0)
+    interpreter.load(filename, source_format)
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return retained / len(interpreter.program_lines), peak
+
+# Command Line Interface
+
+@click.command()
+@click.option('--sizes', default=DEFAULT_SIZES, show_default=True,
+              help='Comma separated program sizes, in lines.')
+@click.option('-f', '--format', 'source_format',
+              type=click.Choice(['t', 'text', 'c', 'card'],
+                                case_sensitive=False),
+              default='text', show_default=True,
+              help='Format of the generated programs.')
+@click.option('--seed', type=int, default=0, show_default=True,
+              help='Seeds the program generator.')
+def cesilbench(sizes: str, source_format: str, seed: int):
+    """CESILBench - Measures CESIL load() time and memory against program
+    size.
+
+    \b
+      Reports time per line, memory per instruction and peak memory for
+    each size of generated program; linear scaling shows as roughly
+    constant per-line figures, and a warning is given if they are not.
+    """
+    print('{0:>10} {1:>12} {2:>10} {3:>12} {4:>10}'.format(
+        'Lines', 'Load (s)', 'us/line', 'bytes/instr', 'Peak (MB)'))
+    per_line = []
+    for size in [int(size) for size in sizes.split(',')]:
+        with tempfile.NamedTemporaryFile(
+                'w', suffix='.ces', delete=False) as writer:
+            writer.writelines(generate_lines(size, source_format, seed))
+        try:
+            elapsed = time_load(writer.name, source_format)
+            memory, peak = load_memory(writer.name, source_format)
+        finally:
+            os.remove(writer.name)
+        per_line.append((elapsed / size, memory))
+        print('{0:>10} {1:>12.3f} {2:>10.2f} {3:>12.1f} {4:>10.1f}'.format(
+            size, elapsed, elapsed * 1e6 / size, memory, peak / 1e6))
+
+    if (per_line[-1][0] > per_line[0][0] * SUPERLINEAR_RATIO or
+            per_line[-1][1] > per_line[0][1] * SUPERLINEAR_RATIO):
+        click.echo('Warning: per-line cost grows with program size; '
+                   'load() may be superlinear', err=True)
+
+
+# Run!
+if __name__ == '__main__':
+    cesilbench()
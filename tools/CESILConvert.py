@@ -0,0 +1,56 @@
+# CESIL Convert - Bulk TEXT/CARD source format converter
+#
+# Copyright (C) 2020-2023, Ian Michael Dunmore
+#
+# License: https://github.com/idunmore/CESIL/blob/master/LICENSE
+
+import os
+import sys
+import click
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+from CESIL import CESIL
+
+# Command Line Interface
+
+@click.command()
+@click.option('-s', '--source',
+              type=click.Choice(['a', 'auto', 't', 'text', 'c', 'card'],
+                                case_sensitive=False),
+              default='auto', show_default=True,
+              help='Format of the source files (auto-detected by default).')
+@click.option('-t', '--to', 'target',
+              type=click.Choice(['t', 'text', 'c', 'card'],
+                                case_sensitive=False),
+              default='text', show_default=True, help='Format to convert to.')
+@click.option('-p', '--plus', is_flag=True, default=False,
+              help='Recognise "plus" mode language extensions.')
+@click.option('-o', '--output-dir', type=click.Path(file_okay=False),
+              help='Directory for converted files (default: stdout).')
+@click.argument('source_files', nargs=-1, type=click.Path(exists=True))
+def cesilconvert(source: str, target: str, plus: bool, output_dir: str,
+                 source_files: tuple[str]):
+    """CESILConvert - Converts CESIL programs between TEXT and CARD format.
+
+    \b
+      Each file is streamed, one line at a time, so corpora of any size can
+    be converted.  Comments and data sections are copied unchanged.
+    """
+    if output_dir is not None: os.makedirs(output_dir, exist_ok=True)
+
+    for source_file in source_files:
+        converter = CESIL(plus, 0)
+        with open(source_file, 'r') as reader:
+            lines = converter.convert(reader, source, target)
+            if output_dir is None:
+                sys.stdout.writelines(lines)
+            else:
+                output_file = os.path.join(
+                    output_dir, os.path.basename(source_file))
+                with open(output_file, 'w') as writer:
+                    writer.writelines(lines)
+
+
+# Run!
+if __name__ == '__main__':
+    cesilconvert()
@@ -0,0 +1,353 @@
+# CESIL Fuzz - Differential fuzzer for the CESIL Plus Interpreter engines
+#
+# Copyright (C) 2020-2023, Ian Michael Dunmore
+#
+# License: https://github.com/idunmore/CESIL/blob/master/LICENSE
+
+import io
+import os
+import random
+import sys
+import tempfile
+import time
+import click
+from concurrent.futures import ProcessPoolExecutor
+from typing import Self
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+from CESIL import (CESIL, CESILHooks, CESILProfile, CESILProgram,
+                   CESILResultCache, VALUE_MAX, VALUE_MIN)
+
+# Classes
+
+class NoOpHooks(CESILHooks):
+    '''Forces the instrumented run loop'''
+
+    def on_step(self: Self, cesil: CESIL, index: int, line: object):
+        pass
+
+
+class NoOpTraceHooks(NoOpHooks):
+    '''Forces the instrumented run loop, keeping compiled loop traces'''
+
+    def on_trace(self: Self, cesil: CESIL, trace: list, iterations: int,
+                 ended: bool):
+        pass
+
+# Constants
+
+# Engines compared against the reference (method-per-instruction, no
+# optimizations) interpreter, and their CESIL() keyword arguments.  Output,
+# errors and final state must all match (a cached run's replayed result has
+# no final state).
+REFERENCE = 'reference'
+ENGINES = {
+    REFERENCE: {'optimize': False},
+    'optimized': {'optimize': True},
+    'instrumented': {'optimize': True, 'hooks': NoOpHooks},
+    'instrumented traces': {'optimize': True, 'hooks': NoOpTraceHooks},
+    'memoized': {'optimize': True, 'memoize': True},
+    'profiled': {'optimize': True, 'profile': True},
+    'output quota': {'optimize': True, 'max_output': 1 << 20},
+    'loop detection': {'optimize': True, 'detect_loops': True},
+    'cached': {'optimize': True, 'cache': True},
+}
+
+# Instructions executed per run before it is stopped
+DEFAULT_MAX_STEPS = 5000
+
+# Each worker's result cache, shared by all its cases, so runs of different
+# programs that are given the same key are caught
+cache_directory = None
+
+# Program generation
+LABELS = ['L1', 'L2', 'L3', 'L4', 'SUB1', 'SUB2']
+VARIABLES = ['A', 'B', 'C', 'COUNT']
+EDGE_VALUES = [0, 1, -1, 2, VALUE_MAX, VALUE_MIN, VALUE_MAX // 2, 1000]
+STANDARD = ['LOAD', 'STORE', 'ADD', 'SUBTRACT', 'MULTIPLY', 'DIVIDE', 'IN',
+            'OUT', 'LINE', 'PRINT', 'JUMP', 'JIZERO', 'JINEG', 'HALT']
+PLUS = ['MODULO', 'RANDOM', 'PUSH', 'POP', 'INC', 'DEC', 'INPUTN', 'OUTCHAR',
+        'JUMPSR', 'JSIZERO', 'JSINEG', 'RETURN', 'MLOAD', 'MLOADA', 'MSTORE']
+LITERAL_VAR = {'LOAD', 'ADD', 'SUBTRACT', 'MULTIPLY', 'DIVIDE', 'MODULO',
+               'RANDOM', 'MLOAD', 'MSTORE'}
+LABEL_OPERAND = {'JUMP', 'JIZERO', 'JINEG', 'JUMPSR', 'JSIZERO', 'JSINEG'}
+
+# Functions
+
+def generate_case(rng: random.Random, is_plus: bool) -> dict:
+    '''Generates a random, valid, program with data and INPUTN values'''
+    instructions = STANDARD + PLUS if is_plus else STANDARD
+    size = rng.randint(3, 30)
+    labels = rng.sample(LABELS, k=min(size, rng.randint(1, 4)))
+    label_lines = dict(zip(rng.sample(range(size + 1), k=len(labels)),
+                           labels))
+
+    lines = []
+    for index in range(size + 1):
+        # A LABEL may be on a line of its own, even after the last line
+        if index in label_lines and (index == size or rng.random() < 0.3):
+            lines.append(label_lines.pop(index))
+        if index == size: break
+
+        instruction = rng.choice(instructions)
+        if instruction in LITERAL_VAR:
+            operand = (rng.choice(VARIABLES) if rng.random() < 0.5
+                       else str(rng.choice(EDGE_VALUES + [rng.randint(
+                           -100, 100)])))
+            if instruction == 'RANDOM': operand = str(rng.randint(0, 50))
+        elif instruction == 'STORE':
+            operand = rng.choice(VARIABLES)
+        elif instruction in LABEL_OPERAND:
+            operand = rng.choice(labels)
+        elif instruction == 'PRINT':
+            operand = '"{0}"'.format(rng.choice(['A', ' b ', 'x  y', '']))
+        else:
+            operand = ''
+        lines.append('{0:<8}{1:<8} {2}'.format(
+            label_lines.get(index, ''), instruction, operand).rstrip())
+
+    # Give variables a value before any are read
+    prologue = ['        LOAD     {0}'.format(rng.randint(-20, 20))] + [
+        '        STORE    {0}'.format(name) for name in VARIABLES]
+
+    return {'program': prologue + lines,
+            'data': [rng.choice(EDGE_VALUES + [rng.randint(-50, 50)])
+                     for _ in range(rng.randint(0, 10))],
+            'input': [rng.randint(-50, 50) for _ in range(rng.randint(0, 5))],
+            'plus': is_plus, 'seed': rng.randint(0, 1 << 30)}
+
+
+def load_program(case: dict) -> CESILProgram | None:
+    '''Parses a case's program once, for every engine to share; None if it
+    does not load (each engine then reports the error itself)'''
+    cesil = CESIL(case['plus'], 0)
+    try:
+        cesil.load_lines(case['program'], 'text')
+    except Exception:
+        return None
+    return cesil.program
+
+
+def record_profile(case: dict, program: CESILProgram | None,
+                   max_steps: int) -> CESILProfile | None:
+    '''Profiles a run of a case, as the profiled engine's earlier run'''
+    if program is None: return None
+    cesil = program.context(seed=case['seed'])
+
+    profile = CESILProfile(cesil)
+    cesil.add_hooks(profile)
+    cesil.set_data(case['data'])
+    cesil.set_input(case['input'])
+    cesil.set_output(io.StringIO())
+    try:
+        cesil.run(max_steps)
+    except Exception:
+        pass
+    return profile
+
+
+def run_engine(case: dict, program: CESILProgram | None, engine: str,
+               max_steps: int) -> tuple:
+    '''Runs a case on an engine, sharing its loaded "program" if there is
+    one; returns its outcome, for comparison'''
+    options = dict(ENGINES[engine])
+    hooks = options.pop('hooks', None)
+    profile = None
+    if options.pop('profile', False):
+        profile = record_profile(case, program, max_steps)
+    cache = None
+    if options.pop('cache', False):
+        global cache_directory
+        if cache_directory is None:
+            cache_directory = tempfile.TemporaryDirectory()
+        cache = CESILResultCache(cache_directory.name)
+        # A program with the same instructions but different LABELs must
+        # not share the result, which the first run saves and the second
+        # replays
+        moved = moved_label(case['program'])
+        if moved is not None:
+            run_cached(dict(case, program=moved), None, options, cache,
+                       max_steps)
+        run_cached(case, program, options, cache, max_steps)
+
+    if cache is not None:
+        output, error, _ = run_cached(case, program, options, cache,
+                                      max_steps)
+        return output, error, None
+
+    cesil = CESIL(case['plus'], 0, seed=case['seed'], **options)
+    output = io.StringIO()
+    error = None
+    try:
+        if program is None:
+            cesil.load_lines(case['program'], 'text')
+        else:
+            cesil.use_program(program)
+        if profile is not None: cesil.apply_profile(profile)
+        cesil.set_data(case['data'])
+        cesil.set_input(case['input'])
+        cesil.set_output(output)
+        if hooks is not None: cesil.add_hooks(hooks())
+        cesil.run(max_steps)
+    except Exception as err:
+        error = describe_error(err)
+
+    state = (cesil.accumulator, sorted(cesil.variables.items()),
+             list(cesil.stack), cesil._data_ptr, list(cesil.memory))
+    return output.getvalue(), error, state
+
+
+def run_cached(case: dict, program: CESILProgram | None, options: dict,
+               cache: CESILResultCache, max_steps: int) -> tuple:
+    '''Runs a case through "cache"; returns its outcome, with the context
+    that ran it'''
+    cesil = CESIL(case['plus'], 0, seed=case['seed'], **options)
+    output = io.StringIO()
+    error = None
+    try:
+        if program is None:
+            cesil.load_lines(case['program'], 'text')
+        else:
+            cesil.use_program(program)
+        cesil.set_data(case['data'])
+        cesil.set_input(case['input'])
+        cesil.set_output(output)
+        cesil.run_cached(cache, max_steps)
+    except Exception as err:
+        error = describe_error(err)
+    return output.getvalue(), error, cesil
+
+
+def moved_label(program: list[str]) -> list[str] | None:
+    '''"program" with its first LABEL on a line of its own moved to after
+    the last line, leaving every instruction on the same line; None if it
+    has no such LABEL before its last line'''
+    for index, line in enumerate(program[:-1]):
+        if line in LABELS:
+            return program[:index] + ['*'] + program[index + 1:] + [line]
+    return None
+
+
+def describe_error(err: Exception) -> tuple:
+    '''An error's type, message and line, for comparison'''
+    return (type(err).__name__, getattr(err, 'message', str(err)),
+            getattr(err, 'line_number', None))
+
+
+def outcomes_differ(reference: tuple, other: tuple,
+                    exact_steps: bool) -> bool:
+    '''True if an engine's outcome differs from the reference outcome.
+    Unless "exact_steps", the engine skips steps the reference takes.'''
+    if reference[1] is not None and reference[1][1].startswith('Step limit'):
+        if other[1] is not None and other[1][0] == 'InfiniteLoopDetected':
+            # Stopped in the loop the reference ran until its limit
+            return not reference[0].startswith(other[0])
+        if not exact_steps:
+            # Tail-call elimination skips RETURNs, so the engine gets further
+            return not other[0].startswith(reference[0])
+    if other[0] != reference[0]: return True
+    if (reference[1] is None) != (other[1] is None): return True
+    if reference[1] is not None:
+        # Tail-call elimination reports RETURN-without-call at the
+        # subroutine's RETURN rather than the caller's; same message.
+        same_line = (reference[1][1] == 'RETURN without SUBROUTINE call'
+                     or reference[1][2] == other[1][2])
+        if reference[1][:2] != other[1][:2] or not same_line: return True
+    return other[2] is not None and other[2] != reference[2]
+
+
+def differing_engines(case: dict, max_steps: int) -> list[str]:
+    '''Engines whose outcome for "case" differs from the reference'''
+    program = load_program(case)
+    reference = run_engine(case, program, REFERENCE, max_steps)
+    # Every optimization but tail-call elimination counts the steps it skips
+    exact_steps = program is None or all(
+        optimized.instruction == line.instruction for optimized, line
+        in zip(program.views[(True, False)][0], program.lines))
+    return [engine for engine in ENGINES if engine != REFERENCE and
+            outcomes_differ(reference, run_engine(case, program, engine,
+                                                  max_steps), exact_steps)]
+
+
+def minimize(case: dict, max_steps: int) -> dict:
+    '''Removes program lines, data and input values while the case still
+    shows a difference, giving the smallest reproducer found'''
+    changed = True
+    while changed:
+        changed = False
+        for key in ('program', 'data', 'input'):
+            index = 0
+            while index < len(case[key]):
+                smaller = dict(case)
+                smaller[key] = case[key][:index] + case[key][index + 1:]
+                if differing_engines(smaller, max_steps):
+                    case = smaller
+                    changed = True
+                else:
+                    index += 1
+    return case
+
+
+def fuzz(worker: int, workers: int, seed: int, duration: float,
+         max_steps: int) -> tuple[int, list[dict]]:
+    '''Fuzzes until "duration" seconds pass, returning the number of cases
+    run and the minimized reproducers found'''
+    end = time.monotonic() + duration
+    cases = 0
+    failures = []
+    while time.monotonic() < end:
+        case_seed = seed + worker + cases * workers
+        rng = random.Random(case_seed)
+        case = generate_case(rng, rng.random() < 0.7)
+        cases += 1
+        engines = differing_engines(case, max_steps)
+        if engines:
+            case = minimize(case, max_steps)
+            case['engines'] = differing_engines(case, max_steps)
+            case['case_seed'] = case_seed
+            failures.append(case)
+    return cases, failures
+
+# Command Line Interface
+
+@click.command()
+@click.option('--duration', type=float, default=60, show_default=True,
+              help='Seconds to fuzz for.')
+@click.option('-j', '--jobs', type=click.IntRange(min=1),
+              default=os.cpu_count(), show_default=True,
+              help='Worker processes.')
+@click.option('--seed', type=int, default=0, show_default=True,
+              help='First case seed; reruns are reproducible.')
+@click.option('--max-steps', type=click.IntRange(min=1),
+              default=DEFAULT_MAX_STEPS, show_default=True,
+              help='Maximum instructions executed per run.')
+def cesilfuzz(duration: float, jobs: int, seed: int, max_steps: int):
+    """CESILFuzz - Differential fuzzer for the CESIL engines.
+
+    \b
+      Runs random CESIL and CESIL "Plus" programs on every engine and
+    reports the smallest reproducer for any whose output, error or final
+    state differs from the reference interpreter.
+    """
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        results = list(executor.map(
+            fuzz, range(jobs), [jobs] * jobs, [seed] * jobs,
+            [duration] * jobs, [max_steps] * jobs))
+
+    cases = sum(result[0] for result in results)
+    failures = [case for result in results for case in result[1]]
+    for case in failures:
+        click.echo('Difference ({0}) for case seed {1}:'.format(
+            ', '.join(case['engines']), case['case_seed']))
+        click.echo('\n'.join(case['program']))
+        click.echo('% ' + ' '.join(str(value) for value in case['data']))
+        click.echo('INPUTN: {0}  RANDOM seed: {1}  Plus: {2}\n'.format(
+            case['input'], case['seed'], case['plus']))
+    click.echo('{0} cases, {1} differences'.format(cases, len(failures)),
+               err=True)
+    sys.exit(1 if failures else 0)
+
+
+# Run!
+if __name__ == '__main__':
+    cesilfuzz()
@@ -0,0 +1,140 @@
+# CESIL Gen - Synthetic CESIL program generator
+#
+# Copyright (C) 2020-2023, Ian Michael Dunmore
+#
+# License: https://github.com/idunmore/CESIL/blob/master/LICENSE
+
+import random
+import sys
+import click
+from typing import Iterator
+
+# Constants
+
+# Line layouts, as written by CESIL.convert()
+TEXT_LINE = '{0:<8}{1:<8} {2}'
+CARD_LINE = '{0:<8}{1:<8}{2}'
+
+# Relative frequency of each kind of line in the code section, roughly
+# that of hand written teaching programs
+LINE_WEIGHTS = {
+    'LOAD': 14, 'STORE': 12, 'ADD': 8, 'SUBTRACT': 6, 'MULTIPLY': 4,
+    'DIVIDE': 2, 'IN': 5, 'OUT': 8, 'LINE': 7, 'PRINT': 12, 'JUMP': 3,
+    'JINEG': 4, 'JIZERO': 4, 'COMMENT': 6, 'BLANK': 3}
+
+# One instruction line in LABEL_EVERY has a label
+LABEL_EVERY = 8
+
+# One VARIABLE per VARIABLE_EVERY lines (at least MIN_VARIABLES)
+VARIABLE_EVERY = 40
+MIN_VARIABLES = 8
+
+# DATA section values per line
+DATA_PER_LINE = 12
+
+PRINT_TEXT = ['Total:', 'Count is ', 'Result =', 'DONE!', 'A  B  C', '']
+DIGITS = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+
+# Functions
+
+def identifier(prefix: str, number: int) -> str:
+    '''A six character IDENTIFIER; five base 36 digits allow 60M names, and
+    no six character instruction starts with L or V'''
+    digits = ''
+    for _ in range(5):
+        number, digit = divmod(number, len(DIGITS))
+        digits = DIGITS[digit] + digits
+    return prefix + digits
+
+
+def generate_lines(lines: int, source_format: str = 'text',
+                   seed: int = 0) -> Iterator[str]:
+    '''Generates a valid CESIL program, with "lines" code section lines
+    and a DATA section holding a value for each IN, in TEXT or CARD format'''
+    rng = random.Random(seed)
+    is_text = source_format[0].casefold() == 't'
+    line_format = TEXT_LINE if is_text else CARD_LINE
+    kinds = list(LINE_WEIGHTS)
+    weights = list(LINE_WEIGHTS.values())
+    variables = max(MIN_VARIABLES, lines // VARIABLE_EVERY)
+    labels = 0
+    stored = [identifier('V', 0)]
+    inputs = 0
+
+    # Every variable is read only after it is stored
+    yield line_format.format('', 'LOAD', 0) + '\n'
+    yield line_format.format('', 'STORE', stored[0]) + '\n'
+
+    for index in range(lines - 3):
+        kind = rng.choices(kinds, weights)[0]
+        if kind == 'COMMENT':
+            yield '* Generated line {0}\n'.format(index)
+            continue
+        if kind == 'BLANK':
+            yield '\n'
+            continue
+
+        label = ''
+        if labels == 0 or rng.randrange(LABEL_EVERY) == 0:
+            label = identifier('L', labels)
+            labels += 1
+
+        if kind in ('LOAD', 'ADD', 'SUBTRACT', 'MULTIPLY'):
+            operand = (rng.choice(stored) if rng.random() < 0.5
+                       else rng.randint(-999, 999))
+        elif kind == 'DIVIDE':
+            operand = rng.randint(1, 99)
+        elif kind == 'STORE':
+            operand = identifier('V', rng.randrange(variables))
+            if len(stored) < variables: stored.append(operand)
+        elif kind == 'PRINT':
+            operand = '"{0}"'.format(rng.choice(PRINT_TEXT))
+        elif kind in ('JUMP', 'JINEG', 'JIZERO'):
+            # Mostly loops back to a recent label, sometimes further back
+            operand = identifier('L', max(0, labels - 1 - int(
+                rng.expovariate(0.5))))
+        else:
+            operand = ''
+            if kind == 'IN': inputs += 1
+        yield line_format.format(label, kind, operand).rstrip() + '\n'
+
+    yield line_format.format('', 'HALT', '').rstrip() + '\n'
+
+    # The DATA section
+    yield '%\n'
+    for start in range(0, inputs, DATA_PER_LINE):
+        count = min(DATA_PER_LINE, inputs - start)
+        yield ' '.join(str(rng.randint(-999, 999))
+                       for _ in range(count)) + '\n'
+    yield '*\n'
+
+
+def generate_program(lines: int, source_format: str = 'text',
+                     seed: int = 0) -> str:
+    '''Generates a program (see generate_lines()) as a single string'''
+    return ''.join(generate_lines(lines, source_format, seed))
+
+# Command Line Interface
+
+@click.command()
+@click.option('-t', '--to', 'target',
+              type=click.Choice(['t', 'text', 'c', 'card'],
+                                case_sensitive=False),
+              default='text', show_default=True, help='Format to generate.')
+@click.option('--seed', type=int, default=0, show_default=True,
+              help='Seeds the generator; equal seeds give equal programs.')
+@click.argument('lines', type=click.IntRange(min=3))
+def cesilgen(target: str, seed: int, lines: int):
+    """CESILGen - Generates a valid CESIL program of LINES code lines.
+
+    \b
+      Programs mix labels, variables, arithmetic, jumps, PRINT, comments
+    and IN (with a matching DATA section) in realistic proportions, and
+    are written to stdout.
+    """
+    sys.stdout.writelines(generate_lines(lines, target, seed))
+
+
+# Run!
+if __name__ == '__main__':
+    cesilgen()
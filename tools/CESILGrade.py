@@ -0,0 +1,192 @@
+# CESIL Grade - Grading harness for CESIL programs
+#
+# Copyright (C) 2020-2023, Ian Michael Dunmore
+#
+# License: https://github.com/idunmore/CESIL/blob/master/LICENSE
+
+import glob
+import json
+import os
+import sys
+import click
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from typing import Self
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+from CESIL import (CESIL, CESILException, CESILProgram, CESILResultCache,
+                   START_DATA_SECTION, END_FILE)
+
+# Constants
+
+# Test case files: NAME.in holds the data section, NAME.out expected output
+DATA_SUFFIX = '.in'
+EXPECTED_SUFFIX = '.out'
+
+# Default maximum instructions per test case
+DEFAULT_MAX_STEPS = 1000000
+
+# The program being graded, in each worker process (see share_program())
+program = None
+
+# Classes
+
+class OutputMismatch(CESILException):
+    '''Program output differs from the expected output'''
+
+    def __init__(self: Self, line_number: int, position: int, code: object):
+        super().__init__(line_number, 'Output differs from expected', code)
+        self.position = position
+
+
+class ExpectedOutput():
+    '''Output sink that compares program output with the expected output
+    as it is written, stopping the run at the first difference'''
+
+    def __init__(self: Self, cesil: CESIL, expected: str):
+        self._cesil = cesil
+        self._expected = expected
+        self.position = 0
+
+    def write(self: Self, text: str):
+        end = self.position + len(text)
+        expected = self._expected[self.position:end]
+        if text != expected:
+            # Find the first character that differs
+            offset = 0
+            while offset < len(expected) and text[offset] == expected[offset]:
+                offset += 1
+            self.position += offset
+            # Output replayed from the cache (see CESIL.run_cached()) is
+            # from no line of this run, so from line 0
+            raise OutputMismatch(self._cesil.line_number, self.position,
+                                 text)
+        self.position = end
+
+# Functions
+
+def read_data(filename: str) -> list[int]:
+    '''Reads a data section file; % and * marker lines are optional'''
+    values = []
+    with open(filename, 'r') as reader:
+        for line in reader:
+            if line[:1] in (START_DATA_SECTION, END_FILE): continue
+            values.extend(int(value) for value in line.split())
+    return values
+
+
+def find_test_cases(test_dir: str) -> list[str]:
+    '''Names (paths without suffix) of the test cases in "test_dir"'''
+    pattern = os.path.join(test_dir, '*' + EXPECTED_SUFFIX)
+    return sorted(name[:-len(EXPECTED_SUFFIX)] for name in glob.glob(pattern))
+
+
+def share_program(loaded: CESILProgram):
+    '''Worker process initializer; every test case the worker grades runs
+    "loaded" (passed once per worker, or inherited when forked)'''
+    global program
+    program = loaded
+
+
+def grade(test_case: str, max_steps: int, cache_dir: str | None) -> dict:
+    '''Runs one test case of the shared program, returning its result;
+    with "cache_dir", the results of unchanged programs are reused'''
+    with open(test_case + EXPECTED_SUFFIX, 'r') as reader:
+        expected = reader.read()
+
+    cesil = program.context()
+    if os.path.exists(test_case + DATA_SUFFIX):
+        cesil.set_data(read_data(test_case + DATA_SUFFIX))
+    cesil.set_input(())
+    output = ExpectedOutput(cesil, expected)
+    cesil.set_output(output)
+
+    result = {'test': os.path.basename(test_case), 'passed': False,
+              'position': None, 'steps': 0, 'error': None}
+    try:
+        if cache_dir is not None:
+            cesil.run_cached(CESILResultCache(cache_dir), max_steps)
+        else:
+            cesil.run(max_steps)
+        if output.position == len(expected):
+            result['passed'] = True
+        else:
+            result['error'] = 'Output ended early'
+    except CESILException as err:
+        result['error'] = '{0} at source line {1}'.format(
+            err.message, err.line_number)
+
+    result['steps'] = cesil.steps
+    if not result['passed']:
+        position = output.position
+        result['position'] = {
+            'offset': position,
+            'line': expected.count('\n', 0, position) + 1,
+            'column': position - expected.rfind('\n', 0, position)}
+
+    return result
+
+# Command Line Interface
+
+@click.command()
+@click.option('-s', '--source',
+              type=click.Choice(['a', 'auto', 't', 'text', 'c', 'card'],
+                                case_sensitive=False),
+              default='auto', show_default=True,
+              help='Text or Card input (auto-detected by default).')
+@click.option('-p', '--plus', is_flag=True, default=False,
+              help='Enables "plus" mode language extensions.')
+@click.option('--max-steps', type=click.IntRange(min=0),
+              default=DEFAULT_MAX_STEPS, show_default=True,
+              help='Maximum instructions executed per test case.')
+@click.option('-j', '--jobs', type=click.IntRange(min=1),
+              help='Test cases run in parallel (default: one per core).')
+@click.option('--json', 'as_json', is_flag=True, default=False,
+              help='Reports results as JSON.')
+@click.option('--cache', 'cache_dir', type=click.Path(file_okay=False),
+              help='Reuses results of identical runs saved in this folder.')
+@click.argument('source_file', type=click.Path(exists=True))
+@click.argument('test_dir', type=click.Path(exists=True, file_okay=False))
+def cesilgrade(source: str, plus: bool, max_steps: int, jobs: int,
+               as_json: bool, cache_dir: str, source_file: str,
+               test_dir: str):
+    """CESILGrade - Grades a CESIL program against test cases.
+
+    \b
+      Each test case in TEST_DIR is a NAME.out file of expected output,
+    with an optional NAME.in file replacing the program's data section.
+    Output is compared as it is produced, and a run stops at the first
+    difference (or, with --cache, when it ends).
+    """
+    # The program is parsed once, and shared with each worker as it starts;
+    # each test case runs it in a new context.
+    cesil = CESIL(plus, 0)
+    cesil.load(source_file, source)
+    test_cases = find_test_cases(test_dir)
+    with ProcessPoolExecutor(max_workers=jobs, initializer=share_program,
+                             initargs=(cesil.program,)) as executor:
+        results = list(executor.map(
+            partial(grade, max_steps=max_steps, cache_dir=cache_dir),
+            test_cases))
+
+    if as_json:
+        click.echo(json.dumps(results, indent=2))
+    else:
+        for result in results:
+            status = 'PASS' if result['passed'] else 'FAIL'
+            detail = ''
+            if not result['passed']:
+                detail = ' @ line {0}, column {1}: {2}'.format(
+                    result['position']['line'], result['position']['column'],
+                    result['error'])
+            click.echo('{0} {1} ({2} steps){3}'.format(
+                status, result['test'], result['steps'], detail))
+
+    passed = sum(result['passed'] for result in results)
+    click.echo('{0}/{1} passed'.format(passed, len(results)), err=True)
+    sys.exit(0 if passed == len(results) else 1)
+
+
+# Run!
+if __name__ == '__main__':
+    cesilgrade()